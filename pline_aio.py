@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#coding: utf-8
+
+# === asyncio HTTP front end for Pline server ===
+# Serves the plineServer request handlers from an event loop: HTTP/1.1 keep-alive connections
+# and idle clients cost no threads, the blocking handler code runs in bounded thread pools.
+# Requires Python 3.7+ (used by pline_server.py when asyncserver = YES)
+# Distributed under the MIT license [https://opensource.org/licenses/MIT]
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import io
+import logging
+import os
+import socket
+import threading
+from urllib.parse import urlsplit, parse_qsl
+
+MAXHEADER = 64*1024 #max. size of a request line + headers
+KEEPALIVE = 75 #seconds to keep an idle client connection open
+MAXBUFFER = 1024*1024 #max. unsent response bytes per connection (handler thread waits when exceeded)
+STREAMS = ('events', 'follow') #request params of long-lived responses (served from a separate thread pool)
+LONGPOLLS = ('lease',) #POST actions that wait for data (worker agents send the action also in the query string)
+
+#request body for a handler thread (reads the event loop stream up to Content-Length)
+class BodyReader(object):
+    def __init__(self, loop, reader, length):
+        self.loop = loop
+        self.reader = reader
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining: size = self.remaining
+        if size <= 0: return b''
+        data = asyncio.run_coroutine_threadsafe(self.reader.read(size), self.loop).result()
+        if not data: raise ConnectionResetError('Client disconnected')
+        self.remaining -= len(data)
+        return data
+
+#response stream for a handler thread (data is queued to the connection's writer coroutine)
+class ResponseWriter(object):
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.cond = threading.Condition()
+        self.buffered = 0
+        self.started = False #response headers sent
+        self.error = None
+
+    def _put(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    def write(self, data):
+        data = bytes(data)
+        with self.cond:
+            while self.buffered > MAXBUFFER and not self.error: self.cond.wait()
+            if self.error: raise self.error
+            self.buffered += len(data)
+        if data:
+            self.started = True
+            self._put(data)
+        return len(data)
+
+    #send a file segment from the event loop (handler can return without waiting for the transfer)
+    def sendfile(self, f, start=0, length=None):
+        if self.error: raise self.error
+        if length is None: length = os.fstat(f.fileno()).st_size - start
+        self._put((os.fdopen(os.dup(f.fileno()), 'rb'), start, length))
+        return length
+
+    def flush(self):
+        pass #queued data is sent as soon as possible
+
+    def close(self):
+        self._put(None)
+
+    def sent(self, nbytes):
+        with self.cond:
+            self.buffered -= nbytes
+            self.cond.notify_all()
+
+    def fail(self, error):
+        with self.cond:
+            if not self.error: self.error = error
+            self.cond.notify_all()
+
+#asyncio HTTP server using a BaseHTTPRequestHandler subclass for the responses
+class AsyncServer(object):
+    def __init__(self, address, handler, workers=32, streamworkers=256):
+        self.handler = handler
+        self.pool = ThreadPoolExecutor(workers) #regular requests
+        self.streams = ThreadPoolExecutor(streamworkers) #event/log subscriptions
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen(1024)
+        self.server_address = self.socket.getsockname()
+        self.loop = None
+
+    def serve_forever(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self.handle, sock=self.socket, limit=MAXHEADER))
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            self.pool.shutdown(wait=False)
+            self.streams.shutdown(wait=False)
+
+    def server_close(self):
+        self.socket.close()
+
+    #serve the requests of one client connection
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')[:2]
+        try:
+            keepalive = True
+            while keepalive:
+                try: head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE)
+                except asyncio.LimitOverrunError:
+                    writer.write(b'HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError): break
+                keepalive = await self.respond(head, reader, writer, peer)
+            await writer.drain()
+        except (ConnectionError, OSError) as e:
+            logging.debug('Disconnected request from %s: %s' % (peer, e))
+        finally:
+            writer.close()
+
+    #run the request handler in a worker thread, send its output => keep connection open?
+    async def respond(self, head, reader, writer, peer):
+        reqline, _, rawheaders = head.partition(b'\r\n')
+        words = reqline.decode('iso-8859-1').split()
+        if len(words) != 3 or not words[2].startswith('HTTP/'):
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return False
+        (command, path, version) = words
+        headers = http.client.parse_headers(io.BytesIO(rawheaders))
+        keepalive = version == 'HTTP/1.1' and 'close' not in headers.get('Connection', '').lower()
+        if headers.get('Transfer-Encoding'): #chunked uploads are not supported
+            writer.write(b'HTTP/1.1 411 Length Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return False
+        try: length = int(headers.get('Content-Length') or 0)
+        except ValueError: length = -1
+        if length < 0:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return False
+        if length and headers.get('Expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        out = ResponseWriter(self.loop)
+        body = BodyReader(self.loop, reader, length)
+        req = self.handler.__new__(self.handler) #set up the handler without running its socket loop
+        req.server = self
+        req.connection = None
+        req.client_address = peer
+        req.rfile = body
+        req.wfile = out
+        req.requestline = reqline.decode('iso-8859-1')
+        req.command = command
+        req.path = path
+        req.request_version = version
+        req.protocol_version = 'HTTP/1.1' if keepalive else 'HTTP/1.0'
+        req.headers = headers
+        req.close_connection = not keepalive
+        query = parse_qsl(urlsplit(path).query, keep_blank_values=True)
+        params = [k for (k, v) in query if v or k in STREAMS]
+        longpoll = any(p in STREAMS for p in params) or any([k == 'action' and v in LONGPOLLS for (k, v) in query]) and command == 'POST'
+        pool = self.streams if longpoll else self.pool
+
+        sender = self.loop.create_task(self.send(writer, out))
+        try: await self.loop.run_in_executor(pool, self.run, req, out)
+        finally:
+            out.close()
+            await sender
+        if out.error or body.remaining: return False #broken connection or unread request data
+        return not req.close_connection
+
+    #(in a worker thread) call do_GET/do_POST
+    def run(self, req, out):
+        method = getattr(req, 'do_'+req.command, None)
+        try:
+            if method: method()
+            else: req.send_error(501, 'Unsupported method (%r)' % req.command)
+        except (ConnectionError, OSError) as e:
+            if not out.error: logging.debug('Request %s failed: %s' % (req.path, e))
+            req.close_connection = True
+        except Exception as e:
+            logging.exception('Request %s failed: %s' % (req.path, e))
+            if not out.started: req.send_error(500)
+            req.close_connection = True
+
+    #send queued response data
+    async def send(self, writer, out):
+        while True:
+            item = await out.queue.get()
+            if item is None: break
+            try:
+                if isinstance(item, bytes):
+                    writer.write(item)
+                    await writer.drain()
+                    out.sent(len(item))
+                else:
+                    (f, start, length) = item
+                    with f:
+                        if not out.error: await self.loop.sendfile(writer.transport, f, start, length)
+            except (ConnectionError, OSError) as e:
+                out.fail(e)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+#coding: utf-8
+
+# === HTTP load benchmark for Pline server ===
+# Starts the threaded and the asyncio server side by side and measures request throughput,
+# latency and server footprint with a set of idle (keep-alive) client connections open.
+# Usage: python3 pline_benchmark.py [-n requests] [-c clients] [-i idle connections]
+# Distributed under the MIT license [https://opensource.org/licenses/MIT]
+
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+plinedir = os.path.dirname(os.path.realpath(__file__))
+
+#start a server process and wait until it accepts requests
+def start_server(port, extra=[]):
+    cmd = [sys.executable, os.path.join(plinedir, 'pline_server.py'), '-p', str(port), '-q', '-c', '-l', '-n'] + extra
+    proc = subprocess.Popen(cmd, cwd=plinedir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for i in range(100):
+        try:
+            socket.create_connection(('localhost', port), 1).close()
+            return proc
+        except socket.error: time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('Server did not start: '+' '.join(cmd))
+
+#read server memory use and thread count (Linux)
+def footprint(pid):
+    stats = {}
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                (key, _, val) = line.partition(':')
+                if key in ('VmRSS', 'Threads'): stats[key] = val.split()[0]
+    except IOError: pass
+    return '%s MB RSS, %s threads' % (int(stats.get('VmRSS', 0))//1024 or '?', stats.get('Threads', '?'))
+
+#send requests from one client (reuses the connection when the server keeps it open)
+def client(port, paths, nreq, times, errors):
+    conn = http.client.HTTPConnection('localhost', port, timeout=30)
+    for i in range(nreq):
+        t = time.time()
+        try:
+            conn.request('GET', paths[i % len(paths)])
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200: errors.append(resp.status)
+            if resp.will_close: conn.close()
+        except (socket.error, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+        times.append(time.time()-t)
+    conn.close()
+
+def benchmark(port, proc, args):
+    idle = []
+    for i in range(args.idle): #connected clients without active requests
+        try: idle.append(socket.create_connection(('localhost', port)))
+        except socket.error: break
+    time.sleep(0.5)
+    idlestats = footprint(proc.pid)
+    (times, errors) = ([], [])
+    per_client = args.requests//args.clients
+    threads = [threading.Thread(target=client, args=(port, args.paths, per_client, times, errors)) for i in range(args.clients)]
+    start = time.time()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.time()-start
+    stats = footprint(proc.pid)
+    for s in idle: s.close()
+    times.sort()
+    pct = lambda p: times[min(len(times)-1, int(len(times)*p))]*1000 if times else 0
+    return {'req/s': len(times)/elapsed, 'p50': pct(0.5), 'p99': pct(0.99), 'errors': len(errors),
+        'idle': '%d idle conn.: %s' % (len(idle), idlestats), 'load': stats}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the threaded and asyncio HTTP front ends of Pline server.")
+    parser.add_argument("-n", "--requests", type=int, default=5000, help="total nr. of requests (default: 5000)")
+    parser.add_argument("-c", "--clients", type=int, default=50, help="nr. of concurrent clients (default: 50)")
+    parser.add_argument("-i", "--idle", type=int, default=500, help="nr. of idle connections held open (default: 500)")
+    parser.add_argument("-p", "--port", type=int, default=8101, help="first server port (default: 8101)")
+    parser.add_argument("paths", nargs='*', default=['/?checkserver', '/pline.css'], help="requested URL paths")
+    args = parser.parse_args()
+
+    results = []
+    for (name, port, extra) in (('threaded', args.port, []), ('asyncio', args.port+1, ['--async'])):
+        proc = start_server(port, extra)
+        try: results.append((name, benchmark(port, proc, args)))
+        finally:
+            proc.terminate()
+            proc.wait()
+    print('%d requests (%s), %d clients' % (args.requests, ', '.join(args.paths), args.clients))
+    for (name, r) in results:
+        print('%-9s %8.0f req/s  p50 %6.1f ms  p99 %7.1f ms  errors %d' % (name, r['req/s'], r['p50'], r['p99'], r['errors']))
+        print('          %s; under load: %s' % (r['idle'], r['load']))
+
+if __name__ == '__main__':
+    main()
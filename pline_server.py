@@ -9,40 +9,54 @@
 
 #import some standard libraries
 import argparse
-import cgi
+from collections import OrderedDict, deque
+from email.utils import formatdate, parsedate_tz, mktime_tz
+import errno
+import hashlib
+import heapq
+import hmac
 try: #if python 3
     import configparser
 except ImportError: #rename for python 2
     import ConfigParser as configparser 
-from glob import glob
 import json
 import logging
 import logging.handlers
 import multiprocessing
 import os
-try: #python 3
-    import queue
-except ImportError: #python 2
-    import Queue as queue
 import re
 import resource
 import shlex
 import shutil
+import signal
 import smtplib
 import socket
+import sqlite3
 from subprocess import Popen, PIPE
+try: from subprocess import SubprocessError #(preexec_fn errors)
+except ImportError: SubprocessError = OSError #py2: re-raised as is
 import sys
 import tempfile
 import threading
 import time
+import uuid
 try:  #python 3
     from urllib.request import urlopen
-    from urllib.parse import unquote
+    from urllib.parse import unquote, quote, parse_qsl, urlsplit
     from urllib.error import URLError
+    from http.client import HTTPConnection
 except ImportError:  #python 2
-    from urllib import unquote, urlopen
+    from urllib import unquote, quote, urlopen
     from urllib2 import URLError
+    from urlparse import parse_qsl, urlsplit
+    from httplib import HTTPConnection
 import webbrowser
+import zipfile
+import zlib
+try: #optional brotli compression of static files
+    import brotli
+except ImportError:
+    brotli = None
 try:  #python 3
     from http.server import BaseHTTPRequestHandler, HTTPServer
     from socketserver import ThreadingMixIn
@@ -78,7 +92,13 @@ plugindir = os.path.join(plinedir, (getconf('plugindir') or 'plugins'))
 if not os.path.exists(plugindir): os.makedirs(plugindir, 0o775)
 serverport = getconf('serverport', 'int') or 8000
 num_workers = getconf('workerthreads', 'int') or multiprocessing.cpu_count()
+minworkers = getconf('minworkers', 'int')
+maxworkers = getconf('maxworkers', 'int') or num_workers
+maxcores = getconf('maxcores', 'int') or num_workers
+maxmemory = getconf('maxmemory', 'int')
 timelimit = getconf('timelimit', 'int')
+walllimit = getconf('walllimit', 'int')
+memlimit = getconf('memlimit', 'int')
 datalimit = getconf('datalimit', 'int')
 filelimit = getconf('filelimit', 'int')
 logtofile = getconf('logtofile','bool')
@@ -90,9 +110,34 @@ hostname = getconf('hostname') or ''
 dataids = getconf('dataids', 'bool')
 dataexpire = getconf('dataexpire', 'int')
 expiremsg = getconf('expiremsg', 'bool')
+zipcache = getconf('zipcache', 'int')
+resultcache = getconf('resultcache', 'int')
+dedupinputs = getconf('dedupinputs', 'bool')
+agentkey = getconf('agentkey') or ''
+asyncserver = getconf('asyncserver', 'bool')
+httpthreads = getconf('httpthreads', 'int') or 32
+eventthrottle = 2 #min. seconds between status/log pushes to a subscribed client
+eventtimeout = 3600 #max. duration of a status subscription (seconds)
+loglimit = 1024*1024 #max. bytes sent per log stream response
+reservetimeout = 600 #max. seconds a queued job waits while smaller jobs are backfilled
+queueaging = 1800 #seconds in the queue that raise the priority class of a job by one
+shortjob = 60 #max. expected running time (seconds) of a short job (scheduled before longer ones)
+sharehalflife = 3600 #half-life (seconds) of the past resource usage counted in owner fair share
+lowwatermark = 0.9 #data dir size (share of datalimit) where the removal of least recently used files stops
+tempexpire = 86400 #seconds to keep temp. download files
+leasetimeout = 60 #seconds without a heartbeat before a job leased to a worker agent is requeued
+agentbeat = 10 #seconds between worker agent heartbeats
+resizeinterval = 10 #seconds between worker pool size checks (also checked when jobs are queued)
+loadhigh = 1.0 #load average per CPU core above which the worker pool shrinks
+memlow = 0.1 #share of free system memory below which the worker pool shrinks
 
-prev_cleanup = '' #last datafiles cleanup date
 job_queue = None #queue for running programs
+zip_cache = None #streamed zip archives of job directories
+result_cache = None #outputs of finished jobs (for identical resubmissions)
+blob_store = None #uploaded input files (shared by the job dirs)
+disk_usage = None #size of the data dir
+job_catalog = None #index of jobs in the data dir
+blocksize = 64*1024 #read/write block size for streamed file transfers
 
 #set up logging
 class TimedFileHandler(logging.handlers.TimedRotatingFileHandler):
@@ -121,7 +166,7 @@ def info(msg):
 def apath(path, d=datadir):
     path = os.path.realpath(path)
     testdir = os.path.realpath(d)
-    if(d is 'skip' or path.startswith(testdir)): return path
+    if(d == 'skip' or path.startswith(testdir)): return path
     else: raise IOError('Restricted path: '+path)
 
 #join paths with confinment check
@@ -171,46 +216,112 @@ def send_job_done(jobid):
     if 'email' not in md: return
     msg = '''This is just a notification that your pipeline ({name}) has finished.
     You can download the results from http://{host}?data={jobid}
-    '''.format(name=md.name, host=hostname, jobid=jobid)
-    sendmail('Pline pipeline finished', msg, md.email)
+    '''.format(name=md.get('name'), host=hostname, jobid=jobid)
+    sendmail('Pline pipeline finished', msg, md['email'])
 
-#remove obsolete data files
-def cleanup():
-    global prev_cleanup #previous cleanup date
-    
-    def oversized(): #check datadir size
-        if datalimit and getsize(datadir) > datalimit*1000:
-            return True
-        return False
-    osize = oversized()
+#background removal of obsolete data files: expired job dirs (dataexpire), least recently used
+#job dirs when the data dir exceeds datalimit (down to lowwatermark) and old temp. download files
+class Janitor(object):
+    def __init__(self, interval=3600, pause=0.2):
+        self.interval = interval #seconds between reloads of the expiry schedule from the job catalog
+        self.pause = pause #min. seconds between dir removals (rate limit)
+        self.expiry = [] #heap of (due time, action, job dir): action 'expire' or 'remind'
+        self.loaded = 0
+        self.accessed = {} #job dir => last access time (not yet in the catalog)
+        self.reminded = set() #job dirs with an expiry reminder sent
+        self.wakeup = threading.Event()
 
-    today = time.strftime("%d%m%y")
-    if osize or prev_cleanup is not today: #throttle: 1 cleanup/day
-        try:
-            for filename in os.listdir(tempdir): #remove temp. download files
-                filepath = os.path.join(tempdir, filename)
-                if os.path.isfile(filename): os.remove(filename)
-            if dataexpire or osize: #remove overflow/expired task files
-                for dirname in os.listdir(datadir):
-                    dirpath = os.path.join(datadir, dirname)
-                    metafile = os.path.join(dirpath, Metadata.FILE)
-                    if(not os.path.isdir(dirpath) or not os.path.isfile(metafile)): continue
-                    md = Metadata(metafile)
-                    if(md['keepData']): continue #keep flagged data dirs
-                    edittime = os.path.getmtime(metafile)
-                    dirage = (time.time()-edittime)//86400 #file age in days
-                    if(dirage > dataexpire or oversized()): #remove obsolete datadir
-                        job_queue.terminate(dirname) #might include a queued/running task
-                        dircount = len(sum([trio[1] for trio in os.walk(dirpath)],[])) #nr of subdirs
-                        shutil.rmtree(apath(dirpath, datadir))
-                        info('Cleanup: removed data dir %s (%s analyses from %s days ago)' % (dirname, dircount, int(dirage)))
-                    elif(dirage == dataexpire-1 and expiremsg and gmail and  md['email']): #send a reminder email
-                        msg = 'The result files from your program run is about to exire in 24h.\r\n'
-                        msg += 'You can download the files before the expiry date from: %s/%s' % (hostname, dirname)
-                        sendmail('Data expiry reminder', msg, md['email'])
-        except (OSError, IOError) as why:
-            logging.error('Data cleanup failed: '+str(why))
-        prev_cleanup = today
+    def start(self):
+        t = threading.Thread(target=self._loop)
+        t.daemon = True
+        t.start()
+
+    def wake(self): #check the data dir soon (does not block)
+        self.wakeup.set()
+
+    def touch(self, jobid): #job files or status requested
+        if jobid: self.accessed[jobid.split('/')[0]] = time.time()
+
+    def schedule(self): #(re)build the expiry heap
+        heap = []
+        if dataexpire:
+            for (dirname, edittime, email) in job_catalog.roots():
+                heap.append((edittime+dataexpire*86400, 'expire', dirname))
+                if expiremsg and gmail and email and dirname not in self.reminded:
+                    heap.append((edittime+(dataexpire-1)*86400, 'remind', dirname))
+        heapq.heapify(heap)
+        self.expiry = heap
+        self.loaded = time.time()
+
+    def _loop(self):
+        while True:
+            now = time.time()
+            timeout = self.loaded+self.interval-now
+            if self.expiry: timeout = min(timeout, self.expiry[0][0]-now)
+            if datalimit: timeout = min(timeout, 300) #(job outputs add data between submissions)
+            self.wakeup.wait(max(timeout, 1))
+            self.wakeup.clear()
+            try: self.run()
+            except Exception as e: logging.error('Data cleanup failed: %s' % e)
+
+    def run(self):
+        if self.accessed: #(swap before writing: touch() runs in request threads)
+            (accessed, self.accessed) = (self.accessed, {})
+            job_catalog.touch(accessed)
+        if time.time()-self.loaded > self.interval:
+            self.schedule()
+            self.remove_temp_files()
+        while self.expiry and self.expiry[0][0] <= time.time(): #expired job dirs
+            (due, action, dirname) = heapq.heappop(self.expiry)
+            try:
+                current = job_catalog.root(dirname) #=> (last update, email); None = removed or keepData
+                if not current: continue
+                edited = current[0] + (dataexpire-1 if action == 'remind' else dataexpire)*86400
+                if edited > due: #updated after scheduling
+                    heapq.heappush(self.expiry, (edited, action, dirname))
+                elif action == 'remind':
+                    self.reminded.add(dirname)
+                    msg = 'The result files from your program run is about to exire in 24h.\r\n'
+                    msg += 'You can download the files before the expiry date from: %s/%s' % (hostname, dirname)
+                    sendmail('Data expiry reminder', msg, current[1])
+                else: self.remove(dirname, 'expired')
+            except Exception as e: #(continue with the other dirs)
+                logging.error('Cleanup: failed to %s %s: %s' % (action, dirname, e))
+        limit = datalimit*(10**6)
+        if limit and disk_usage.size() > limit: #oversized: remove least recently used job dirs
+            active = set([jobid.split('/')[0] for jobid in list(job_queue.jobs.keys())])
+            for (dirname, used) in job_catalog.lru_roots():
+                if disk_usage.size() <= limit*lowwatermark: break
+                if dirname in active: continue
+                try: self.remove(dirname, 'data dir over the size limit')
+                except Exception as e: logging.error('Cleanup: failed to remove %s: %s' % (dirname, e))
+            if disk_usage.size() > limit: logging.info('Cleanup: data dir size over the limit (%d MB)' % datalimit)
+
+    def remove(self, dirname, reason):
+        dirpath = os.path.join(datadir, dirname)
+        if(not os.path.isdir(dirpath)): #removed outside of Pline
+            job_catalog.remove(dirname)
+            return
+        started = time.time()
+        for jobid in [j for j in list(job_queue.jobs.keys()) if j == dirname or j.startswith(dirname+'/')]:
+            job_queue.terminate(jobid) #queued/running tasks in the dir (with dataids, the root dir is not a job)
+        dircount = len(sum([trio[1] for trio in os.walk(dirpath)],[])) #nr of subdirs
+        dirsize = remove_dir(apath(dirpath, datadir))
+        metadata_store.forget(dirpath)
+        job_catalog.remove(dirname)
+        disk_usage.add(-dirsize)
+        self.reminded.discard(dirname)
+        info('Cleanup: removed data dir %s (%s analyses, %d MB; %s)' % (dirname, dircount, dirsize//(10**6), reason))
+        time.sleep(max(self.pause, time.time()-started)) #leave the disk to the running jobs
+
+    def remove_temp_files(self): #old temp. download files
+        for filename in os.listdir(tempdir):
+            filepath = os.path.join(tempdir, filename)
+            try:
+                if os.path.isfile(filepath) and time.time()-os.path.getmtime(filepath) > tempexpire: os.remove(filepath)
+            except OSError: pass #(removed meanwhile)
+
+janitor = Janitor()
 
 #init dir for new program run
 def create_job_dir(name='analysis', d=datadir):
@@ -231,16 +342,673 @@ def create_job_dir(name='analysis', d=datadir):
     md = Metadata.create(dirpath)
     return dirpath
 
+#physical memory in MB (0 = unknown)
+def system_memory():
+    try: return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024*1024)
+    except (AttributeError, ValueError, OSError): return 0
+
 #get filesize of a file/dirpath
-def getsize(start_path = datadir): 
+def getsize(start_path = datadir, subdirs=True, seen=None): #seen: set of counted inodes (physical size)
     total_size = 0
     for dirpath, dirnames, filenames in os.walk(start_path):
         for f in filenames:
             fp = os.path.join(dirpath, f)
-            try: total_size += os.path.getsize(fp)
-            except OSError: pass
+            try: st = os.lstat(fp)
+            except OSError: continue
+            if seen is not None and st.st_nlink > 1: #hardlinked file: count once
+                if st.st_ino in seen: continue
+                seen.add(st.st_ino)
+            total_size += st.st_size
+        if not subdirs: break
     return total_size
 
+#delete a data dir => nr. of freed bytes (shared files are freed with their last link)
+def remove_dir(dirpath):
+    freed = 0
+    shared = []
+    for path, dirnames, filenames in os.walk(dirpath):
+        for f in filenames:
+            try: st = os.lstat(os.path.join(path, f))
+            except OSError: continue
+            if st.st_nlink > 1: shared.append(st.st_ino)
+            else: freed += st.st_size
+    shutil.rmtree(dirpath)
+    if blob_store and shared: freed += blob_store.release(shared)
+    return freed
+
+#running total of the data dir size (updated on file changes, reconciled in the background)
+class DiskUsage(object):
+    def __init__(self, path=datadir, interval=6*3600):
+        self.path = path
+        self.interval = interval #seconds between full rescans
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        t = threading.Thread(target=self._reconcile_loop)
+        t.daemon = True
+        t.start()
+
+    def size(self):
+        return self.total
+
+    def add(self, nbytes): #register written (+) or removed (-) bytes
+        if not nbytes: return
+        with self.lock:
+            self.total = max(self.total + nbytes, 0)
+        if datalimit and nbytes > 0 and self.total > datalimit*(10**6): janitor.wake() #(removes old files)
+
+    def reconcile(self): #recount the data dir
+        started = time.time()
+        total = getsize(self.path, seen=set()) #physical bytes
+        with self.lock:
+            drift = total - self.total
+            self.total = total
+        logging.debug("Data dir size: %d bytes (drift %d; counted in %.1fs)" % (total, drift, time.time()-started))
+
+    def _reconcile_loop(self):
+        while True:
+            try: self.reconcile()
+            except Exception as e: logging.error("Data dir size check failed: %s" % e)
+            time.sleep(self.interval)
+
+#request body/file exceeds the size limit
+class SizeLimitError(Exception):
+    pass
+
+#form field of a POST request (kept in memory or spooled to a file)
+class FormPart(object):
+    MAXMEM = 1024*1024 #max. size of an in-memory field (larger fields are spooled to disk)
+
+    def __init__(self, name, filename='', spooldir=datadir, maxsize=0):
+        self.name = name
+        self.filename = filename
+        self.spooldir = spooldir
+        self.maxsize = maxsize
+        self.size = 0
+        self.chunks = []
+        self.file = None
+        self.path = '' #spooled/saved filepath
+        self.saved = False
+        self.hash = hashlib.sha256() if filename else None #content hash of uploaded files
+        if filename: self.spool()
+
+    def spool(self): #switch to disk storage
+        (fd, self.path) = tempfile.mkstemp(prefix='.upload_', dir=self.spooldir)
+        self.file = os.fdopen(fd, 'wb')
+        for chunk in self.chunks: self.file.write(chunk)
+        self.chunks = []
+
+    def write(self, data):
+        if not data: return
+        self.size += len(data)
+        if self.maxsize and self.size > self.maxsize:
+            raise SizeLimitError('Input %s exceeds the file size limit (%d MB)' % (self.name or self.filename, self.maxsize//(10**6)))
+        if self.file is None and self.size > FormPart.MAXMEM: self.spool()
+        if self.hash: self.hash.update(data)
+        if self.file: self.file.write(data)
+        else: self.chunks.append(data)
+
+    def close(self):
+        if self.file: self.file.close()
+
+    def value(self): #field content (text fields as string)
+        if self.path: #(spooled large field)
+            with open(self.path, 'rb') as f: data = f.read()
+        else: data = b''.join(self.chunks)
+        if self.filename or bytes is str: return data
+        return data.decode('utf-8', 'replace')
+
+#content-addressed store of uploaded files (job dirs get hardlinks to the stored files)
+#the link count of a stored file is its reference count: it is removed when no job dir links to it
+class BlobStore(object):
+    def __init__(self, path, catalog):
+        self.path = path
+        self.catalog = catalog #index of stored files: inode => hash (shared sqlite db)
+        self.lock = threading.Lock()
+        if not os.path.isdir(path): os.makedirs(path, 0o775)
+        with catalog.lock:
+            catalog.db.execute('CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER, inode INTEGER, created REAL)')
+            catalog.db.execute('CREATE INDEX IF NOT EXISTS blobs_inode ON blobs (inode)')
+        self.release(None) #remove files of job dirs deleted outside of Pline
+
+    def blobpath(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def link(self, part, filepath): #store an uploaded form field => hash
+        digest = part.hash.hexdigest()
+        blob = self.blobpath(digest)
+        with self.lock:
+            if not os.path.isfile(blob):
+                if not os.path.isdir(os.path.dirname(blob)): os.makedirs(os.path.dirname(blob), 0o775)
+                if part.path and not part.saved: os.rename(part.path, blob) #move the spooled file
+                elif part.path: shutil.copyfile(part.path, blob)
+                else: write_file(blob, b''.join(part.chunks))
+                os.chmod(blob, 0o444) #shared by jobs: keep read-only
+                with self.catalog.lock:
+                    self.catalog.db.execute('INSERT OR REPLACE INTO blobs (hash, size, inode, created) VALUES (?, ?, ?, ?)',
+                        (digest, part.size, os.stat(blob).st_ino, time.time()))
+                disk_usage.add(part.size)
+            elif part.path and not part.saved: os.remove(part.path) #duplicate upload
+            if os.path.lexists(filepath): os.remove(filepath)
+            try: os.link(blob, filepath)
+            except OSError: shutil.copyfile(blob, filepath) #(different filesystem)
+        part.path = blob
+        part.saved = True
+        return digest
+
+    def release(self, inodes): #remove unreferenced blobs (of the given inodes; None = all) => freed bytes
+        freed = 0
+        with self.lock:
+            with self.catalog.lock:
+                if inodes is None: rows = self.catalog.db.execute('SELECT hash, size FROM blobs').fetchall()
+                else:
+                    rows = []
+                    inodes = list(set(inodes))
+                    for i in range(0, len(inodes), 500): #(sqlite variable limit)
+                        batch = inodes[i:i+500]
+                        rows += self.catalog.db.execute('SELECT hash, size FROM blobs WHERE inode IN (%s)' % ','.join('?'*len(batch)), batch).fetchall()
+            removed = 0
+            for (digest, size) in rows:
+                blob = self.blobpath(digest)
+                try:
+                    if os.stat(blob).st_nlink > 1: continue #still linked from a job dir
+                    os.remove(blob)
+                    freed += size
+                    removed += 1
+                except OSError as e:
+                    if e.errno != errno.ENOENT: continue
+                with self.catalog.lock:
+                    self.catalog.db.execute('DELETE FROM blobs WHERE hash = ?', (digest,))
+        if removed: logging.debug("Blob store: removed %d unreferenced files (%d bytes)" % (removed, freed))
+        return freed
+
+    def stored(self, inode): #=> file is a stored blob?
+        with self.catalog.lock:
+            return self.catalog.db.execute('SELECT 1 FROM blobs WHERE inode = ?', (inode,)).fetchone() is not None
+
+    def stats(self): #=> (nr. of stored files, stored bytes)
+        with self.catalog.lock:
+            row = self.catalog.db.execute('SELECT COUNT(*), SUM(size) FROM blobs').fetchone()
+        return (row[0], row[1] or 0)
+
+#incremental parser for POST request forms (streams multipart/form-data fields to disk)
+class Form(object):
+    def __init__(self, rfile, headers, maxpart=0, maxsize=0):
+        self.rfile = rfile
+        self.parts = {} #field name => FormPart
+        self.maxpart = maxpart #size limit for each field
+        try: self.remaining = int(headers.get('Content-Length', 0))
+        except ValueError: raise AttributeError('invalid Content-Length header')
+        if maxsize and self.remaining > maxsize: #give up before reading the data
+            raise SizeLimitError('Request size (%d MB) exceeds the data limit (%d MB)' % (self.remaining//(10**6), maxsize//(10**6)))
+        ctype = headers.get('Content-Type', '')
+        try:
+            if ctype.startswith('multipart/form-data'):
+                boundary = re.search(r'boundary="?([^";]+)"?', ctype)
+                if not boundary: raise AttributeError('multipart boundary missing')
+                self.parse_multipart(boundary.group(1).encode())
+            elif ctype.startswith('application/x-www-form-urlencoded'):
+                if self.remaining > FormPart.MAXMEM: raise SizeLimitError('Form data too large')
+                for (key, val) in parse_qsl(self.read(self.remaining).decode('utf-8', 'replace'), keep_blank_values=True):
+                    part = self.parts[key] = FormPart(key)
+                    part.write(val.encode('utf-8'))
+        except:
+            self.close()
+            raise
+
+    def read(self, size=blocksize): #read the request body
+        size = min(size, self.remaining)
+        if size <= 0: return b''
+        data = self.rfile.read(size)
+        if not data: raise IOError('Incomplete POST request')
+        self.remaining -= len(data)
+        return data
+
+    def readmore(self):
+        data = self.read()
+        if not data: raise AttributeError('Malformed multipart form data')
+        return data
+
+    def parse_multipart(self, boundary):
+        delim = b'\r\n--' + boundary
+        buf = b'\r\n' #first delimiter has no preceding newline
+        while delim not in buf: #skip preamble
+            buf = buf[-len(delim):] + self.readmore()
+        buf = buf[buf.index(delim)+len(delim):]
+        while True:
+            while len(buf) < 2: buf += self.readmore()
+            if buf.startswith(b'--'): break #closing delimiter
+            while b'\r\n\r\n' not in buf: #part headers
+                if len(buf) > 16384: raise AttributeError('Malformed multipart form data')
+                buf += self.readmore()
+            (head, buf) = buf.split(b'\r\n\r\n', 1)
+            disp = re.search(r'(?im)^content-disposition:(.*)$', head.decode('utf-8', 'replace'))
+            disp = disp.group(1) if disp else ''
+            name = re.search(r'(?:^|;)\s*name="([^"]*)"', disp)
+            filename = re.search(r';\s*filename="([^"]*)"', disp)
+            part = FormPart(name.group(1) if name else '', filename.group(1) if filename else '', maxsize=self.maxpart)
+            self.parts[part.name] = part
+            try:
+                while True: #stream the part content
+                    i = buf.find(delim)
+                    if i >= 0:
+                        part.write(buf[:i])
+                        buf = buf[i+len(delim):]
+                        break
+                    keep = len(delim)-1 #might be a partial delimiter
+                    if len(buf) > keep:
+                        part.write(buf[:-keep])
+                        buf = buf[-keep:]
+                    buf += self.readmore()
+            finally:
+                part.close()
+        while self.remaining > 0: self.read() #discard epilogue
+
+    def __contains__(self, key):
+        return key in self.parts
+
+    def keys(self):
+        return self.parts.keys()
+
+    def getvalue(self, key, default=None):
+        return self.parts[key].value() if key in self.parts else default
+
+    #store a form field to a file (moves the spooled data) => filename (or False if missing or empty)
+    def save(self, key, filepath, dedup=True):
+        part = self.parts.get(key)
+        if not part or not part.size: return False
+        if blob_store and part.hash and dedup: #link to the stored copy
+            blob_store.link(part, filepath)
+        elif part.saved: #reused in multiple jobs
+            shutil.copyfile(part.path, filepath)
+        elif part.path:
+            shutil.move(part.path, filepath)
+            os.chmod(filepath, 0o664)
+            part.path = filepath
+            part.saved = True
+        else: write_file(filepath, b''.join(part.chunks))
+        return os.path.basename(filepath)
+
+    def close(self): #remove leftover spooled files
+        for part in self.parts.values():
+            if part.path and not part.saved:
+                try: os.remove(part.path)
+                except OSError: pass
+
+#zip archive of a job directory
+class ZipArchive(object):
+    def __init__(self, path, entries, cacheable):
+        self.path = path #cache filepath
+        self.entries = entries #[(filepath, archive name), ...]
+        self.cacheable = cacheable
+        self.cached = cacheable and os.path.isfile(path)
+        self.size = 0 #nr. of bytes written to the cache file
+        self.done = False
+        self.failed = False
+        self.cond = threading.Condition()
+
+#output stream for zipfile: writes to the cache file and the client
+class ZipStream(object):
+    def __init__(self, cachefile, client, archive=None):
+        self.cachefile = cachefile
+        self.client = client
+        self.archive = archive
+        self.error = None
+
+    def write(self, data):
+        if self.cachefile:
+            self.cachefile.write(data)
+            self.cachefile.flush()
+            with self.archive.cond: #notify the followers
+                self.archive.size += len(data)
+                self.archive.cond.notify_all()
+        if self.client:
+            try: self.client.write(data)
+            except socket.error as e: #client disconnected: finish the cache file
+                self.client = None
+                self.error = e
+                if not self.cachefile: raise
+        return len(data)
+
+    def flush(self):
+        pass
+
+#class for zip archives of job directories (streamed while compressing; finished archives are cached)
+class ZipCache(object):
+    #file formats that are stored without (re)compression
+    PACKED = ('.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.zst', '.bam', '.cram', '.png', '.jpg', '.jpeg', '.gif', '.pdf')
+    STREAMING = sys.version_info >= (3, 6) #zipfile can write to unseekable streams
+
+    def __init__(self, cachedir, maxsize=0):
+        self.cachedir = cachedir
+        self.maxsize = maxsize*(10**6) #MB => B
+        self.lock = threading.Lock()
+        self.building = {} #cache filepath => ZipArchive (in progress)
+        if not os.path.exists(cachedir): os.makedirs(cachedir, 0o775)
+        for filename in os.listdir(cachedir): #remove unfinished archives
+            if filename.endswith('.part'): os.remove(os.path.join(cachedir, filename))
+
+    #list a job directory => ZipArchive (cache key: jobid + dir/file timestamps)
+    def archive(self, jobdir):
+        jobroot = os.path.dirname(jobdir)
+        state = hashlib.sha1()
+        entries = []
+        totalsize = 0
+        for dirpath, dirnames, filenames in os.walk(jobdir):
+            dirnames.sort()
+            try: st = os.stat(dirpath)
+            except OSError: continue
+            state.update(('%s %d\n' % (dirpath, st.st_mtime*1000000)).encode('utf-8'))
+            entries.append((dirpath, os.path.relpath(dirpath, jobroot)))
+            for filename in sorted(filenames):
+                fpath = os.path.join(dirpath, filename)
+                try: st = os.stat(fpath)
+                except OSError: continue
+                state.update(('%s %d %d\n' % (filename, st.st_mtime*1000000, st.st_size)).encode('utf-8'))
+                entries.append((fpath, os.path.relpath(fpath, jobroot)))
+                totalsize += st.st_size
+        prefix = hashlib.sha1(os.path.relpath(jobdir, datadir).encode('utf-8')).hexdigest()[:16]
+        cachepath = os.path.join(self.cachedir, '%s_%s.zip' % (prefix, state.hexdigest()[:16]))
+        return ZipArchive(cachepath, entries, bool(self.maxsize) and totalsize <= self.maxsize)
+
+    #stream a new zip archive to the client (or follow the same archive built by another request)
+    def send(self, archive, wfile, sendfile):
+        with self.lock:
+            building = self.building.get(archive.path)
+            if not building and archive.cacheable: self.building[archive.path] = archive
+        if building: #archive in progress: stream from its cache file
+            self.follow(building, sendfile)
+            return
+        if not archive.cacheable:
+            self.write(archive, ZipStream(None, wfile))
+            return
+        partpath = archive.path+'.part'
+        try:
+            with open(partpath, 'wb') as cachefile:
+                stream = ZipStream(cachefile, wfile, archive)
+                self.write(archive, stream)
+            os.rename(partpath, archive.path)
+            with archive.cond:
+                archive.done = True
+                archive.cond.notify_all()
+            self.evict(archive.path)
+        except:
+            with archive.cond:
+                archive.failed = True
+                archive.cond.notify_all()
+            try: os.remove(partpath)
+            except OSError: pass
+            raise
+        finally:
+            with self.lock: del self.building[archive.path]
+        if stream.error: logging.debug('Zip download interrupted: %s' % stream.error)
+
+    def write(self, archive, stream): #compress the files to the output stream
+        zf = zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        for (fpath, arcname) in archive.entries:
+            ctype = zipfile.ZIP_STORED if fpath.lower().endswith(ZipCache.PACKED) else zipfile.ZIP_DEFLATED
+            try: zf.write(fpath, arcname, ctype)
+            except (OSError, IOError) as e: #file removed during archiving
+                if e is stream.error: raise #client disconnected
+                logging.debug('Zip archive: skipped %s (%s)' % (arcname, e))
+        zf.close()
+
+    def follow(self, archive, sendfile): #send an archive that is being written
+        try: f = open(archive.path+'.part', 'rb')
+        except IOError: f = open(archive.path, 'rb') #already finished
+        with f:
+            sent = 0
+            while True:
+                with archive.cond:
+                    while archive.size <= sent and not archive.done and not archive.failed:
+                        archive.cond.wait(1)
+                    size = archive.size
+                if archive.failed: raise IOError('Zip archive failed: '+os.path.basename(archive.path))
+                if size > sent: sent += sendfile(f, sent, size-sent)
+                elif archive.done: break
+
+    def evict(self, newpath): #limit the total size of cached archives (oldest first)
+        prefix = os.path.basename(newpath).split('_')[0]
+        archives = []
+        for filename in os.listdir(self.cachedir):
+            fpath = os.path.join(self.cachedir, filename)
+            if not filename.endswith('.zip') or fpath == newpath: continue
+            try:
+                if filename.startswith(prefix+'_'): #outdated archive of the same job
+                    os.remove(fpath)
+                    continue
+                st = os.stat(fpath)
+                archives.append((st.st_mtime, st.st_size, fpath))
+            except OSError: pass
+        total = sum([a[1] for a in archives]) + os.path.getsize(newpath)
+        for (mtime, size, fpath) in sorted(archives):
+            if total <= self.maxsize: break
+            try:
+                os.remove(fpath)
+                total -= size
+            except OSError: pass
+
+#in-memory copy of a static file (with compressed variants)
+class StaticAsset(object):
+    def __init__(self, data, mtime, size, compress=False):
+        self.mtime = mtime
+        self.size = size
+        self.etag = '%x-%x' % (int(mtime*1000000), size)
+        self.lastmod = formatdate(mtime, usegmt=True)
+        self.variants = {'identity': data}
+        if compress:
+            gz = zlib.compressobj(9, zlib.DEFLATED, 31) #gzip format
+            self.add_variant('gzip', gz.compress(data) + gz.flush())
+            if brotli: self.add_variant('br', brotli.compress(data))
+        self.nbytes = sum([len(v) for v in self.variants.values()])
+
+    def add_variant(self, encoding, data):
+        if len(data) < self.size: self.variants[encoding] = data
+
+    def tag(self, encoding='identity'): #ETag of a content variant
+        return '"%s"' % self.etag if encoding == 'identity' else '"%s-%s"' % (self.etag, encoding)
+
+    #check conditional request headers => client copy is up to date?
+    def not_modified(self, headers):
+        inm = headers.get('If-None-Match')
+        if inm: #ETag match takes precedence over date
+            tags = [t.strip().replace('W/', '', 1) for t in inm.split(',')]
+            return '*' in tags or any([self.tag(enc) in tags for enc in self.variants])
+        ims = headers.get('If-Modified-Since')
+        if ims:
+            try: return int(self.mtime) <= mktime_tz(parsedate_tz(ims))
+            except (TypeError, ValueError, OverflowError): return False
+        return False
+
+    #pick the smallest content encoding accepted by the client => (encoding, data)
+    def variant(self, accept=''):
+        accepted = {}
+        for item in accept.split(','):
+            parts = item.strip().split(';')
+            q = 1.0
+            for p in parts[1:]:
+                p = p.strip()
+                if p.startswith('q='):
+                    try: q = float(p[2:])
+                    except ValueError: q = 0
+            accepted[parts[0].strip().lower()] = q
+        best = 'identity'
+        for enc in ('br', 'gzip'):
+            q = accepted.get(enc, accepted.get('*', 0))
+            if q > 0 and enc in self.variants and len(self.variants[enc]) < len(self.variants[best]): best = enc
+        return (best, self.variants[best])
+
+#cache of the webapp and plugin files (invalidated by file mtime)
+class AssetCache(object):
+    COMPRESS = ('.css', '.js', '.html', '.htm', '.json', '.svg', '.txt', '.xml') #compressible file types
+    MAXFILE = 2*1024*1024 #max. size of a cached file
+
+    def __init__(self, maxsize=64*1024*1024):
+        self.cache = OrderedDict() #filepath => StaticAsset
+        self.maxsize = maxsize
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, fpath): #=> StaticAsset (None if not cacheable)
+        try: st = os.stat(fpath)
+        except OSError: return None
+        if not os.path.isfile(fpath) or st.st_size > AssetCache.MAXFILE: return None
+        with self.lock:
+            asset = self.cache.get(fpath)
+            if asset and (asset.mtime, asset.size) == (st.st_mtime, st.st_size):
+                self.cache[fpath] = self.cache.pop(fpath) #mark as recently used
+                return asset
+        try:
+            with open(fpath, 'rb') as f: data = f.read()
+        except IOError: return None
+        if len(data) != st.st_size: return None #file is being written
+        asset = StaticAsset(data, st.st_mtime, st.st_size, os.path.splitext(fpath)[1].lower() in AssetCache.COMPRESS)
+        logging.debug("Static file %s: cached (%s)" % (fpath, ', '.join(['%s %d' % (k, len(v)) for (k, v) in asset.variants.items()])))
+        with self.lock:
+            old = self.cache.pop(fpath, None)
+            if old: self.size -= old.nbytes
+            self.cache[fpath] = asset
+            self.size += asset.nbytes
+            while self.size > self.maxsize and len(self.cache) > 1:
+                self.size -= self.cache.popitem(last=False)[1].nbytes
+        return asset
+
+static_assets = AssetCache()
+
+#list of plugin/pipeline files and program paths in the plugins dir (rescanned when the dirs change)
+class PluginRegistry(object):
+    OSDIRS = { 'darwin': 'osx', 'linux': 'linux', 'win': 'windows' } #binary location: plugin/[osx|linux|windows|.]/program
+
+    def __init__(self, path, interval=2):
+        self.path = path
+        self.interval = interval #min. seconds between change checks
+        self.checked = 0
+        self.watch = [] #watched dirs and files
+        self.stamp = None #mtimes of the watched paths
+        self.listing = ('', '') #(etag, plugins list json)
+        self.bundle = ('', '') #(etag, plugins list + file contents json)
+        self.execs = {} #(plugin dir, program name) => program path
+        self.specs = {} #plugin file => (mtime, parsed plugin.json)
+        self.osdir = ''
+        for osname in PluginRegistry.OSDIRS:
+            if sys.platform.startswith(osname): self.osdir = PluginRegistry.OSDIRS[osname]
+        self.lock = threading.Lock()
+
+    def mtimes(self, paths):
+        stamp = []
+        for p in paths:
+            try: stamp.append(os.stat(p).st_mtime)
+            except OSError: stamp.append(0)
+        return stamp
+
+    def refresh(self, force=False): #rescan the plugins dir if it has changed
+        with self.lock:
+            now = time.time()
+            if not force and now-self.checked < self.interval: return
+            self.checked = now
+            if not force and self.mtimes(self.watch) == self.stamp: return
+            self.scan()
+
+    def scan(self):
+        def listdir(d): #=> sorted visible dir entries (like glob)
+            try: return sorted([f for f in os.listdir(os.path.join(self.path, d)) if not f.startswith('.')])
+            except OSError: return []
+        isdir = lambda p: os.path.isdir(os.path.join(self.path, p))
+        isjson = lambda p: p.endswith('.json') and os.path.isfile(os.path.join(self.path, p))
+        (dirs, plugins, pipelines) = ([''], [], [])
+        for name in listdir(''): #plugins: */plugin.json
+            if not isdir(name): continue
+            dirs.append(name)
+            if isjson(os.path.join(name, 'plugin.json')): plugins.append(os.path.join(name, 'plugin.json'))
+            if self.osdir and isdir(os.path.join(name, self.osdir)): dirs.append(os.path.join(name, self.osdir))
+        for name in listdir('pipelines'): #pipelines: pipelines/*.json, pipelines/*/*.json
+            fpath = os.path.join('pipelines', name)
+            if isjson(fpath): pipelines.append(fpath)
+            elif isdir(fpath):
+                dirs.append(fpath)
+                pipelines += [os.path.join(fpath, f) for f in listdir(fpath) if isjson(os.path.join(fpath, f))]
+        watch = [os.path.join(self.path, p) for p in dirs + plugins + pipelines]
+        stamp = self.mtimes(watch)
+        files = {}
+        for fpath in plugins + pipelines:
+            try:
+                with open(os.path.join(self.path, fpath), 'rb') as f: files[fpath] = f.read().decode('utf-8', 'replace')
+            except IOError: pass
+        listing = json.dumps({ "plugins": plugins, "pipelines": pipelines })
+        bundle = json.dumps({ "plugins": plugins, "pipelines": pipelines, "bundle": files })
+        etag = lambda data: '"%s"' % hashlib.sha1(data.encode('utf-8')).hexdigest()[:20]
+        (self.watch, self.stamp) = (watch, stamp)
+        self.listing = (etag(listing), listing)
+        self.bundle = (etag(bundle), bundle)
+        self.execs = {}
+        logging.debug("Plugin registry: %d plugins, %d pipelines" % (len(plugins), len(pipelines)))
+
+    def get(self, bundle=False): #=> (etag, json)
+        self.refresh()
+        return self.bundle if bundle else self.listing
+
+    def exec_path(self, plugin, program): #=> command with the program path in the plugin dir
+        self.refresh()
+        cmd = program.split(' ')
+        pdir = os.path.dirname(os.path.join(self.path, plugin))
+        key = (pdir, cmd[0])
+        with self.lock:
+            fpath = self.execs.get(key)
+            if fpath is None:
+                fpath = ''
+                for d in ([os.path.join(pdir, self.osdir)] if self.osdir else []) + [pdir]:
+                    if os.path.isfile(os.path.join(d, cmd[0])) and os.access(os.path.join(d, cmd[0]), os.X_OK):
+                        fpath = os.path.join(d, cmd[0])
+                        break
+                if fpath and pdir in self.watch: self.execs[key] = fpath #cache (invalidated by rescan; misses are rechecked: chmod +x does not change the dir)
+        if not fpath: return program #fallback: use system command
+        cmd[0] = fpath #restore original command
+        return ' '.join(cmd)
+
+    def plugin_json(self, plugin): #=> parsed plugin file ({} if not strict JSON)
+        fpath = os.path.join(self.path, plugin)
+        try: mtime = os.stat(fpath).st_mtime
+        except OSError: return {}
+        with self.lock:
+            cached = self.specs.get(plugin)
+            if cached and cached[0] == mtime: return cached[1]
+        try:
+            with open(fpath, 'rb') as f: data = json.loads(f.read().decode('utf-8'))
+            if not isinstance(data, dict): data = {}
+        except (IOError, ValueError): data = {}
+        with self.lock: self.specs[plugin] = (mtime, data)
+        return data
+
+    #cores and memory declared in plugin.json: "resources": {"cores": 4, "memory": "2G"}
+    #value = number | parameter flag (e.g. "-T") | {"param": "-T", "default": 1}
+    def resources(self, plugin, params=''): #=> (nr. of cores, memory in MB)
+        spec = self.plugin_json(plugin).get('resources')
+        if not isinstance(spec, dict): spec = {}
+        cores = self.amount(spec.get('cores', 1), params) or 1
+        memory = self.amount(spec.get('memory', 0), params, unit=True)
+        return (cores, memory)
+
+    def amount(self, value, params, unit=False): #resource spec => number
+        default = 0
+        if isinstance(value, dict):
+            default = value.get('default', 0)
+            value = value.get('param', '')
+        if hasattr(value, 'startswith') and value.startswith('-'): #read from the command parameters
+            args = params.split()
+            found = default
+            for i, arg in enumerate(args):
+                if arg == value and i+1 < len(args): found = args[i+1]
+                elif arg.startswith(value+'='): found = arg[len(value)+1:]
+            value = found
+        match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*$', str(value), re.I)
+        if not match: return self.amount(default, params, unit) if value != default else 0
+        num = float(match.group(1))
+        if unit: num *= {'k': 1.0/1024, 'm': 1, 'g': 1024, 't': 1024*1024, '': 1}[match.group(2).lower()]
+        return int(num) if num == int(num) else num
+
+plugin_registry = PluginRegistry(plugindir)
+
 #handle client browser => Pline server requests
 class plineServer(BaseHTTPRequestHandler):
     #disable console printout of server events
@@ -257,21 +1025,167 @@ class plineServer(BaseHTTPRequestHandler):
 
     #send OK response (status 200)
     def sendOK(self, msg='', size=0):
+        if not isinstance(msg, bytes): msg = msg.encode() #Python3: unicode => bytestr
         self.send_response(200)
         if size:
             self.send_header("Content-Type", "text/octet-stream")
             self.send_header("Content-Length", str(size))
             self.send_header("Cache-Control", "no-cache")
-        else: self.send_header("Content-Type", "text/plain")
+        else:
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(msg)))
+        self.end_headers()
+        if msg: self.wfile.write(msg)
+
+    #send a cached static file (304 for unchanged client copy)
+    def send_asset(self, asset, ctype, dlname=''):
+        cachectrl = "max-age=300000" if 'image' in ctype else "no-cache" #revalidate webapp files
+        (encoding, data) = asset.variant(self.headers.get('Accept-Encoding', ''))
+        if asset.not_modified(self.headers):
+            self.send_response(304)
+            self.send_header("ETag", asset.tag(encoding))
+            self.send_header("Last-Modified", asset.lastmod)
+            self.send_header("Cache-Control", cachectrl)
+            if len(asset.variants) > 1: self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        if encoding != 'identity': self.send_header("Content-Encoding", encoding)
+        if len(asset.variants) > 1: self.send_header("Vary", "Accept-Encoding")
+        self.send_header("ETag", asset.tag(encoding))
+        self.send_header("Last-Modified", asset.lastmod)
+        self.send_header("Cache-Control", cachectrl)
+        if dlname: self.send_header("Content-Disposition", "attachment; filename="+dlname)
         self.end_headers()
-        if msg:
+        self.wfile.write(data)
+
+    #stream (a part of) an open file to the client (constant memory use)
+    def send_file(self, f, start=0, length=None):
+        if length is None: length = os.fstat(f.fileno()).st_size - start
+        if hasattr(self.wfile, 'sendfile'): return self.wfile.sendfile(f, start, length) #asyncio front end
+        sent = 0
+        sock = getattr(self, 'connection', None)
+        if hasattr(os, 'sendfile') and hasattr(sock, 'fileno'): #zero-copy transfer
+            self.wfile.flush() #send buffered headers first
             try:
-                self.wfile.write(msg)
-            except TypeError: #Python3: unicode => bytestr
-                self.wfile.write(msg.encode())
+                while sent < length:
+                    n = os.sendfile(sock.fileno(), f.fileno(), start+sent, min(length-sent, 16*blocksize))
+                    if not n: break #file truncated
+                    sent += n
+                return sent
+            except OSError as e: #fall back to buffered copy
+                if e.errno not in (errno.EAGAIN, errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP): raise
+                logging.debug("sendfile() failed (%s), using buffered transfer" % e)
+        f.seek(start+sent)
+        while sent < length:
+            chunk = f.read(min(blocksize, length-sent))
+            if not chunk: break
+            self.wfile.write(chunk)
+            sent += len(chunk)
+        return sent
+
+    #parse Range request header => list of (start, end) byte ranges ([] = unsatisfiable, None = send full file)
+    def get_ranges(self, size, etag='', mtime=0):
+        hrange = self.headers.get('Range', '')
+        if not hrange.startswith('bytes='): return None
+        ifrange = self.headers.get('If-Range', '')
+        if ifrange: #send ranges only from an unchanged file
+            if ifrange.startswith('"') or ifrange.startswith('W/'):
+                if ifrange != etag: return None
+            else:
+                t = parsedate_tz(ifrange)
+                if not t or mktime_tz(t) < int(mtime): return None
+        ranges = []
+        for spec in hrange[6:].split(','):
+            start, sep, end = spec.strip().partition('-')
+            try:
+                if not sep: return None
+                if start: #bytes=first-[last]
+                    start, end = int(start), (int(end) if end else max(int(start), size-1))
+                    if end < start: return None #invalid header: ignore
+                elif int(end): #bytes=-suffixlength
+                    start, end = max(size-int(end), 0), size-1
+                else: continue
+            except ValueError: #malformed header: ignore
+                return None
+            if start < size: ranges.append((start, min(end, size-1)))
+        if len(ranges) > 1: #merge overlapping ranges
+            merged = []
+            for (start, end) in sorted(ranges):
+                if merged and start <= merged[-1][1]+1:
+                    merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+                else: merged.append((start, end))
+            ranges = merged
+        return ranges
+
+    #send byte ranges of an open file (206 Partial Content)
+    def send_ranges(self, f, ranges, size, ctype):
+        if len(ranges) == 1:
+            (start, end) = ranges[0]
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+            self.send_header("Content-Length", str(end-start+1))
+            self.end_headers()
+            self.send_file(f, start, end-start+1)
+            return
+        #multiple ranges: send as multipart/byteranges
+        boundary = uuid.uuid4().hex
+        parts = []
+        for (start, end) in ranges:
+            parthead = '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (boundary, ctype, start, end, size)
+            parts.append((parthead.encode(), start, end))
+        closing = ('\r\n--%s--\r\n' % boundary).encode()
+        self.send_header("Content-Type", "multipart/byteranges; boundary="+boundary)
+        self.send_header("Content-Length", str(sum([len(h)+e-s+1 for (h, s, e) in parts])+len(closing)))
+        self.end_headers()
+        for (parthead, start, end) in parts:
+            self.wfile.write(parthead)
+            self.send_file(f, start, end-start+1)
+        self.wfile.write(closing)
+
+    #send a job directory as a zip archive (compressed on the fly)
+    def send_zip(self, archive, filename):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", "attachment; filename="+filename)
+        self.send_header("Connection", "close") #no Content-Length: end of data = closed connection
+        self.end_headers()
+        zip_cache.send(archive, self.wfile, self.send_file)
+
+    def send_response(self, code, message=None): #(response code for the request metrics)
+        self.status_code = code
+        BaseHTTPRequestHandler.send_response(self, code, message)
+
+    #run a request handler (request count and latency metrics)
+    def timed(self, method, handler):
+        started = time.time()
+        (self.action, self.status_code) = ('', 0)
+        try: handler()
+        finally:
+            action = self.action or 'other'
+            metrics.inc('pline_http_requests_total', (('action', action), ('code', str(self.status_code)), ('method', method)))
+            metrics.observe('pline_http_request_duration_seconds', time.time()-started, (('action', action),))
 
-    #serve files (GET requests)
     def do_GET(self):
+        self.timed('GET', self.serve_get)
+
+    def do_POST(self):
+        self.timed('POST', self.serve_post)
+
+    #send the server metrics (Prometheus text format)
+    def send_metrics(self):
+        data = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(data)
+
+    #serve files (GET requests)
+    def serve_get(self):
         path = unquote(self.path)
         params = {}
         filename = ''
@@ -294,11 +1208,19 @@ class plineServer(BaseHTTPRequestHandler):
                 pass
             logging.debug("GET: %s" % (str(params)))
 
+        if path == 'metrics':
+            self.action = 'metrics'
+            self.send_metrics()
+            return
+
         #POST request mirrors
-        postreq = ['checkserver', 'status', 'plugins', 'terminate', 'restart']
+        postreq = ['jobs', 'events', 'log', 'checkserver', 'status', 'plugins', 'usage', 'terminate', 'restart']
+        self.params = params
         for req in postreq:
             if req in params:
-                getattr(self, "post_"+req)(params[req])
+                self.action = req
+                try: getattr(self, "post_"+req)(params[req])
+                except Exception as e: self.send_failure(e, req)
                 return
         
         #split path to dirpath and filename
@@ -316,28 +1238,42 @@ class plineServer(BaseHTTPRequestHandler):
                 p = ''
             return (p, fname)
         
+        partial = False #serve Range requests
         try: #send a file
             if 'data' in params and params['data']: #from the data dir
+                self.action = 'data'
+                janitor.touch(params['data'])
                 rootdir = datadir
+                partial = True
                 (path, filename) = splitpath(params['data'])
+                dlname = filename
                 if not filename: #(job files) direcotry requested: send as a zip archive
-                    jobdir = os.path.join(rootdir, path)
-                    jobroot = os.path.dirname(jobdir)
-                    ziproot = os.path.basename(jobdir)
-                    zipfile = os.path.join(tempdir, ziproot)
-                    if os.path.isdir(jobdir):
-                        filename = os.path.basename( shutil.make_archive(zipfile, 'zip', jobroot, ziproot) )
-                        rootdir = tempdir
-                        path = ''
-                    else:
+                    jobdir = joinp(rootdir, path)
+                    if not os.path.isdir(jobdir):
                         raise IOError('Datadir not found: '+params['data'])
+                    dlname = os.path.basename(jobdir)+'.zip'
+                    if not ZipCache.STREAMING: #python 2: create the archive before sending
+                        zippath = os.path.join(tempdir, os.path.basename(jobdir))
+                        filename = os.path.basename( shutil.make_archive(zippath, 'zip', os.path.dirname(jobdir), os.path.basename(jobdir)) )
+                        (rootdir, path, partial) = (tempdir, '', False)
+                    else:
+                        archive = zip_cache.archive(jobdir)
+                        if not archive.cached:
+                            self.send_zip(archive, dlname)
+                            return
+                        os.utime(archive.path, None) #mark as recently used
+                        (rootdir, path, filename) = (zip_cache.cachedir, '', os.path.basename(archive.path))
             elif 'plugin' in params and params['plugin']: #from the plugins dir
+                self.action = 'plugin'
                 rootdir = plugindir
                 (path, filename) = splitpath(params['plugin'])
                 if(not filename): filename = 'plugin.json'
+                dlname = filename
             else: #from the server dir
+                self.action = 'file'
                 (path, filename) = splitpath()
                 if(not filename): filename = 'index.html'
+                dlname = filename
             
             #set file content-type
             ctype = 'application/octet-stream'
@@ -347,6 +1283,7 @@ class plineServer(BaseHTTPRequestHandler):
                     'text/javascript': ['js'],
                     'text/html': ['htm', 'html'],
                     'application/json': ['json'],
+                    'application/zip': ['zip'],
                     'image/jpg': ['jpg', 'jpeg'],
                     'image/gif': ['gif'],
                     'image/png': ['png']
@@ -364,17 +1301,40 @@ class plineServer(BaseHTTPRequestHandler):
             
             #resolve filepath (with confinment check)
             fpath = joinp(rootdir, path, filename, d=rootdir)
-            #send headers
-            self.send_response(200)
-            self.send_header("Content-Type", ctype)
-            self.send_header("Content-Length", os.path.getsize(fpath))
-            if('image' in ctype): self.send_header("Cache-Control", "max-age=300000")
-            if(rootdir is not plinedir): #send as file download
-                self.send_header("Content-Disposition", "attachment; filename="+filename)
-            self.end_headers()
-            #read & send the requested file
+            if rootdir in (plinedir, plugindir): #webapp files: send from memory
+                asset = static_assets.get(fpath)
+                if asset:
+                    self.send_asset(asset, ctype, '' if rootdir is plinedir else dlname)
+                    return
             with open(fpath, 'rb') as f:
-                self.wfile.write( f.read() )
+                fstat = os.fstat(f.fileno())
+                ranges = None
+                if partial: #resumable downloads of result files
+                    etag = '"%x-%x"' % (int(fstat.st_mtime*1000000), fstat.st_size)
+                    ranges = self.get_ranges(fstat.st_size, etag, fstat.st_mtime)
+                    if ranges == []: #no satisfiable ranges
+                        self.send_response(416)
+                        self.send_header("Content-Range", "bytes */%d" % fstat.st_size)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                #send headers
+                self.send_response(206 if ranges else 200)
+                if partial:
+                    self.send_header("Accept-Ranges", "bytes")
+                    self.send_header("ETag", etag)
+                    self.send_header("Last-Modified", formatdate(fstat.st_mtime, usegmt=True))
+                if('image' in ctype): self.send_header("Cache-Control", "max-age=300000")
+                if(rootdir is not plinedir): #send as file download
+                    self.send_header("Content-Disposition", "attachment; filename="+dlname)
+                if ranges: #send the requested parts of the file
+                    self.send_ranges(f, ranges, fstat.st_size, ctype)
+                    return
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", fstat.st_size)
+                self.end_headers()
+                #stream the requested file
+                self.send_file(f)
         except IOError as e:
             errmsg = 'File Not Found: %s (%s)' % (filename, e.strerror)
             self.sendError(404, errmsg, 'GET')
@@ -387,39 +1347,201 @@ class plineServer(BaseHTTPRequestHandler):
         hostname = self.headers.get('Host') #update
 
         status = { "status": "OK" }
-        confs = ["local", "dataexpire", "timelimit", "filelimit", "datalimit"]
+        confs = ["local", "dataexpire", "timelimit", "walllimit", "memlimit", "filelimit", "datalimit"]
         for conf in confs:
             status[conf] = globals()[conf]
-        status["datasize"] = getsize(datadir)
+        status["datasize"] = disk_usage.size() #physical bytes (shared files counted once)
+        if blob_store:
+            (files, size) = blob_store.stats()
+            status["blobs"] = { "files": files, "size": size }
+        status["capacity"] = job_queue.capacity()
         if(gmail): status["email"] = True
         if(local): 
             status["datadir"] = datadir
             if job_queue.jobs: #list of running jobs
-                status["jobs"] = job_queue.jobs.keys()
+                status["jobs"] = list(job_queue.jobs.keys())
 
         self.sendOK(json.dumps(status))
 
     #send plugins list
-    def post_plugins(self, *a):
-        os.chdir(plugindir)
-        json_paths1 = glob(os.path.join('*', 'plugin.json'))
-        json_paths2 = glob(os.path.join('pipelines', '*.json'))
-        json_paths3 = glob(os.path.join('pipelines', '*', '*.json'))
-        os.chdir(plinedir)
-        self.sendOK( json.dumps({ "plugins": json_paths1, "pipelines": json_paths2 + json_paths3 }) )
+    def post_plugins(self, form):
+        bundle = form.getvalue('bundle') if hasattr(form, 'getvalue') else form == 'bundle' #include file contents
+        (etag, data) = plugin_registry.get(bool(bundle))
+        if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        data = data.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(data)
     
     #send status of a program (datadir metadata)
+    def step_status(self, steps): #=> {step id: status} of pipeline steps
+        status = {}
+        for step in steps:
+            try: status[step] = Metadata(step)['status']
+            except IOError: status[step] = 'Missing' #(step dir removed)
+        return status
+    
     def post_status(self, jobid):
         if(not jobid):
             raise AttributeError('JobID missing')
         jobs = jobid.split(',')
         status = {}
         for id in jobs: #read metadata
+            janitor.touch(id)
             md = Metadata(joinp(datadir, id))
             md.update_log() #attach log output
             status[id] = json.loads(str(md)) #md => plain obj
+            position = job_queue.position(id)
+            if position: status[id]["position"] = position #place in the queue
+            if md['steps']: #pipeline: status of each step
+                status[id]["steps"] = self.step_status(md['steps'])
         self.sendOK( json.dumps(status) )
     
+    #push job status changes to the client (server-sent events; post_status = polling fallback)
+    def post_events(self, jobid):
+        if(not jobid):
+            raise AttributeError('JobID missing')
+        jobs = jobid.split(',')
+        for id in jobs: #(confinment check)
+            if not os.path.isfile(os.path.join(joinp(datadir, id), Metadata.FILE)):
+                return self.sendError(404, 'Job not found: %s' % id, 'events')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(event, data, seq=None):
+            if isinstance(data.get('steps'), list): #(same format as in post_status)
+                data = dict(data, steps=self.step_status(data['steps']))
+            msg = ('id: %d\n' % seq if seq else '') + 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
+            self.wfile.write(msg.encode('utf-8'))
+            self.wfile.flush()
+
+        logs = {} #jobid => last sent log line
+        running = set() #unfinished jobs (and pipeline steps)
+        unfinished = (Job.QUEUED, Job.RUNNING) #(incl. waiting pipeline steps)
+        started = lastsend = lastlog = time.time()
+        try:
+            since = job_events.seq
+            for id in jobs: #send the current status
+                try: md = Metadata(id)
+                except IOError as e:
+                    send('error', {"id": id, "error": str(e)})
+                    continue
+                md.update_log()
+                logs[id] = md['log']
+                send('status', md.metadata, since)
+                if md['status'] in unfinished: running.add(id)
+                for step in md['steps'] or []: #(pipeline is done when all steps are)
+                    try: smd = Metadata(step)
+                    except IOError: continue
+                    if smd['status'] in unfinished: running.add(step)
+            while running and time.time()-started < eventtimeout:
+                (since, events) = job_events.wait(since, jobs, max(lastlog+eventthrottle-time.time(), 0.01))
+                for (seq, id, data) in events:
+                    send('status', data, seq)
+                    lastsend = time.time()
+                    if data.get('status') in unfinished: running.add(id)
+                    else: running.discard(id)
+                if time.time()-lastlog >= eventthrottle: #throttled log updates
+                    lastlog = time.time()
+                    for id in list(running):
+                        if not job_queue.get(id): continue
+                        line = Metadata(id).last_log_line()
+                        if line != logs.get(id):
+                            logs[id] = line
+                            send('log', {"id": id, "log": line})
+                            lastsend = time.time()
+                if time.time()-lastsend > 15: #keep the connection alive
+                    self.wfile.write(b': ping\n\n')
+                    self.wfile.flush()
+                    lastsend = time.time()
+            send('done', {"id": jobid})
+        except socket.error: #client disconnected
+            pass
+
+    #send job output written after the given byte offset (params: file=stdout|stderr, offset=N, limit=N, follow=1)
+    def post_log(self, jobid):
+        if(not jobid):
+            raise AttributeError('JobID missing')
+        if not os.path.isfile(os.path.join(joinp(datadir, jobid), Metadata.FILE)):
+            return self.sendError(404, 'Job not found: %s' % jobid, 'log')
+        md = Metadata(jobid)
+        logfile = md.logfile if self.params.get('file') in ('stderr', 'logfile') else md.stdout
+        try:
+            offset = max(int(self.params.get('offset') or 0), 0)
+            limit = min(int(self.params.get('limit') or loglimit), loglimit)
+        except ValueError:
+            raise AttributeError('Invalid offset or limit')
+        follow = self.params.get('follow') not in (None, '0', 'false')
+        try: f = open(logfile, 'rb')
+        except IOError: #not created yet or removed as empty
+            f = None
+        size = os.fstat(f.fileno()).st_size if f else 0
+        reset = offset > size #log was truncated (restarted job)
+        if reset: offset = 0
+        started = time.time()
+        if follow and self.request_version != 'HTTP/1.1': #(no chunked encoding): wait for new output, then send it
+            while size <= offset and job_queue.get(md['id']) is not None and time.time()-started < eventtimeout:
+                time.sleep(0.5)
+                if not f:
+                    try: f = open(logfile, 'rb')
+                    except IOError: f = None
+                size = os.fstat(f.fileno()).st_size if f else 0
+            follow = False
+        if follow: self.protocol_version = 'HTTP/1.1' #(chunked response)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        if reset: self.send_header("X-Log-Reset", "1")
+        if not follow: #send the available data
+            self.send_header("X-Log-Offset", str(max(min(size, offset+limit), offset)))
+            self.send_header("Content-Length", str(max(min(size, offset+limit)-offset, 0)))
+            self.end_headers()
+            if f:
+                with f: self.send_file(f, offset, min(size, offset+limit)-offset)
+            return
+        #follow mode: stream the new output until the job finishes (or the byte limit is reached)
+        #(chunked response: the offset after the sent data is in the X-Log-Offset trailer)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Trailer", "X-Log-Offset")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        sent = 0
+        try:
+            while sent < limit and time.time()-started < eventtimeout:
+                running = job_queue.get(md['id']) is not None
+                if not f:
+                    try: f = open(logfile, 'rb')
+                    except IOError: f = None
+                size = os.fstat(f.fileno()).st_size if f else 0
+                data = b''
+                if size > offset+sent:
+                    f.seek(offset+sent)
+                    data = f.read(min(size-offset-sent, limit-sent, 16*blocksize))
+                if data:
+                    self.wfile.write(('%x\r\n' % len(data)).encode('ascii') + data + b'\r\n')
+                    self.wfile.flush()
+                    sent += len(data)
+                elif not running: break #job finished and all output sent
+                else: time.sleep(0.5)
+            self.wfile.write(('0\r\nX-Log-Offset: %d\r\n\r\n' % (offset+sent)).encode('ascii'))
+            self.wfile.flush()
+        except socket.error: #client disconnected
+            pass
+        finally:
+            if f: f.close()
+
     #start a new job
     def post_run(self, form):
 
@@ -427,59 +1549,105 @@ class plineServer(BaseHTTPRequestHandler):
 		#plugin => { name:'stepName', program:'cmd', parameters:'param1=v1 param2', 
         #          infiles:'fname1.txt,...', outfiles:'ofile.txt,...', stdout:'output.log', plugin:'dir/path/pluginname'}
 
+        #pipeline steps run in parallel when their dependencies are met: step => depends:[step index/name, ...]
+        #(without any 'depends' lists, each step depends on the previous step)
+
         jobname = form.getvalue('name','untitled')
         response = {}
-        jobdir = datadir
         firstid = ''
-        notify = False
 
-        #check datadir: remove expired/large files
+        #check datadir: remove expired/large files (in the background)
         if datalimit or dataexpire:
-            cleanup()
+            janitor.wake()
 
         #start new background job/pipeline
         pipeline = json.loads(form.getvalue('pipeline','[]'))
         laststep = len(pipeline)
+        owner = self.job_owner(form, pipeline)
+        priority = form.getvalue('priority', 'normal')
+        if priority not in Workqueue.PRIORITY: priority = 'normal'
+        if priority == 'high' and not local: priority = 'normal' #(only in local mode)
         logging.debug("Submitting job '%s' with %i step(s)" % (jobname, laststep))
+        parents = self.pipeline_graph(pipeline)
+        steps = [] #step metadata
         #prepare pipeline files
         for i, data in enumerate(pipeline):
             if('name' not in data or 'program' not in data):
                 raise AttributeError("'name' or 'progam' missing from the submitted job data!")
             jobname = data['name'].replace(' ', '_')
-            jobdir = create_job_dir(jobname, d=jobdir) #init new datadir
+            #step dir: inside the (first) parent step dir
+            parentdir = steps[parents[i][0]].jobdir if parents[i] else steps[0].jobdir if i else datadir
+            jobdir = create_job_dir(jobname, d=parentdir) #init new datadir
             jobid = os.path.relpath(jobdir, datadir)
             md = Metadata(jobdir)
             md['id'] = jobid
             if i == 0:
                 firstid = jobid
                 if 'email' in data:
-                    md['email'] = data['email']
-                    notify = True #notification email requested
+                    md['email'] = data['email'] #notification email requested
             for attr in ['name', 'plugin', 'program', 'parameters', 'infiles', 'outfiles', 'stdout']:
                 md[attr] = data[attr] if attr in data else '' #store metadata
-            step = i+1
+            md['owner'] = owner
+            md['priority'] = priority
             if(laststep > 1):
-                md['step'] = "%d/%d" % (step, laststep)
-                data['_jobdir'] = jobdir
-            if step > 1: #add link to previous step
-                Metadata(pipeline[i-1]['_jobdir']).update('nextstep', jobid)
-            if i == laststep and notify:
-                md['notify'] = firstid
-            md.flush()
+                md['step'] = "%d/%d" % (i+1, laststep)
+                md['pipeline'] = firstid
+            if parents[i]: #wait for the previous steps
+                md['depends'] = [steps[p]['id'] for p in parents[i]]
+                md['waiting'] = True
+            steps.append(md)
             #store input files
             for filename in data['infiles'].split(','):
                 if(not filename.startswith('../')):
-                    write_file(joinp(jobdir, filename, d=jobdir), form.getvalue(filename, ''), True)
+                    filepath = joinp(jobdir, filename, d=jobdir)
+                    if form.save(filename, filepath) and os.stat(filepath).st_nlink == 1: #(new blobs are counted by the store)
+                        disk_usage.add(os.path.getsize(filepath))
+        
+        for i, md in enumerate(steps): #add links to the next steps
+            children = [steps[c]['id'] for c in range(laststep) if i in parents[c]]
+            if children:
+                md['children'] = children
+                md['nextstep'] = children[0]
+            if i == 0 and laststep > 1: md['steps'] = [step['id'] for step in steps]
+            md.flush()
     
         if firstid:
-            Job(firstid) #start the pipeline
+            for i, md in enumerate(steps):
+                if not parents[i]: Job(md['id']) #start the pipeline
             response["id"] = firstid
 
         self.sendOK(json.dumps(response))
     
+    #pipeline step dependencies => list of parent step indexes for each step
+    def pipeline_graph(self, pipeline):
+        if not any(['depends' in data for data in pipeline]): #linear pipeline
+            return [[i-1] if i else [] for i in range(len(pipeline))]
+        names = [data.get('name') for data in pipeline]
+        graph = []
+        for i, data in enumerate(pipeline):
+            deps = data.get('depends') or []
+            if not isinstance(deps, list): deps = [deps]
+            parents = []
+            for dep in deps:
+                p = dep if isinstance(dep, int) else names.index(dep) if dep in names else -1
+                if not 0 <= p < i: #(steps are listed in dependency order => no cycles)
+                    raise AttributeError("Step %s: invalid dependency '%s'" % (i+1, dep))
+                if p not in parents: parents.append(p)
+            graph.append(parents)
+        return graph
+
+    #identify the job submitter for the fair share of the queue (email, session ID or client IP)
+    def job_owner(self, form, pipeline=None):
+        if pipeline and pipeline[0].get('email'): return pipeline[0]['email']
+        if form.getvalue('session'): return 'session:'+form.getvalue('session')
+        ip = self.client_address[0]
+        if ip in ('127.0.0.1', '::1') and self.headers.get('X-Forwarded-For'): #behind a local proxy
+            ip = self.headers.get('X-Forwarded-For').split(',')[0].strip()
+        return 'ip:'+hashlib.sha1(ip.encode()).hexdigest()[:12] #(anonymized)
+
     #check for valid jobdir path
     def check_id(self, form):
-        jobid = form.getvalue('jobid') if 'getvalue' in form else form
+        jobid = form.getvalue('jobid') if hasattr(form, 'getvalue') else form
         if(not jobid): #jobid is reative path to jo dir
             raise AttributeError("rmdir: 'jobid' attribute missing!")
         jobdir = joinp(datadir, jobid, d=datadir) #confinment check
@@ -488,12 +1656,84 @@ class plineServer(BaseHTTPRequestHandler):
             raise IOError("Job not found: "+jobid)
         return jobid
 
+    #list jobs in the library (optional filters: status, email, days)
+    def post_jobs(self, form):
+        if not local:
+            return self.sendError(403, 'Job listing is only available in local mode', 'jobs')
+        opt = form.getvalue if hasattr(form, 'getvalue') else self.params.get
+        status = opt('status')
+        if status is not None and re.match(r'^-?\d+$', status): status = int(status)
+        days = opt('days')
+        since = time.time()-float(days)*86400 if days else 0
+        jobs = job_catalog.query(status=status, email=opt('email'), since=since, limit=int(opt('limit') or 1000))
+        self.sendOK(json.dumps({"jobs": jobs}))
+
+    #resource usage report of finished jobs (optional filter: days)
+    def post_usage(self, form):
+        opt = form.getvalue if hasattr(form, 'getvalue') else self.params.get
+        days = opt('days')
+        since = time.time()-float(days)*86400 if days else 0
+        self.sendOK(json.dumps({"usage": job_catalog.usage_report(since)}))
+
+    #worker agent requests (agentkey setting; without a key, only agents on the server host in local mode are accepted)
+    def check_agent(self, form):
+        if agentkey: allowed = hmac.compare_digest(str(form.getvalue('key', '')), str(agentkey))
+        else: allowed = local and self.client_address[0] in ('127.0.0.1', '::1', '::ffff:127.0.0.1') #(public server: clients of a local proxy look local)
+        if not allowed: raise AttributeError('Worker agent not authorized')
+        return form.getvalue('agent') or self.client_address[0]
+
+    #lease queued jobs to a worker agent (agent:'name', cores:N, memory:MB, slots:N, wait:seconds)
+    def post_lease(self, form):
+        agent = self.check_agent(form)
+        def num(key, default):
+            try: return int(float(form.getvalue(key) or default))
+            except ValueError: return default
+        leased = job_queue.lease(agent, num('cores', 1), num('memory', 0), max(num('slots', 1), 1), min(max(num('wait', 0), 0), 30))
+        self.sendOK(json.dumps({ "jobs": [job.spec(lease) for (job, lease) in leased], "heartbeat": agentbeat }))
+
+    #extend a job lease and append the new log output (stdout/logfile data at stdoutpos/logfilepos) => {ok:false} if the lease is lost
+    def post_heartbeat(self, form):
+        agent = self.check_agent(form)
+        jobid = form.getvalue('jobid', '')
+        ok = job_queue.heartbeat(jobid, form.getvalue('lease', ''), agent)
+        job = job_queue.get(jobid) if ok else None
+        for key in ('stdout', 'logfile'):
+            data = form.getvalue(key)
+            if not job or not job[key] or not data: continue
+            fpath = joinp(job.jobdir, job[key], d=job.jobdir)
+            with open(fpath, 'r+b' if os.path.isfile(fpath) else 'wb') as f:
+                f.seek(int(form.getvalue(key+'pos') or 0))
+                f.truncate()
+                f.write(data)
+        self.sendOK(json.dumps({ "ok": ok }))
+
+    #store the output files of a job run by a worker agent (files:[names], file:name => data, status:exitcode, usage:{})
+    def post_complete(self, form):
+        self.check_agent(form)
+        jobid = self.check_id(form)
+        lease = form.getvalue('lease', '')
+        job = job_queue.get(jobid)
+        if not job or not job_queue.heartbeat(jobid, lease, form.getvalue('agent', '')):
+            self.sendOK(json.dumps({ "ok": False }))
+            return
+        for name in json.loads(form.getvalue('files') or '[]'):
+            fpath = joinp(job.jobdir, name, d=job.jobdir)
+            if not os.path.isdir(os.path.dirname(fpath)): os.makedirs(os.path.dirname(fpath), 0o775)
+            if not form.save('file:'+name, fpath, dedup=False) and not os.path.exists(fpath): write_file(fpath, b'') #(empty file)
+        try: rc = int(form.getvalue('status'))
+        except (TypeError, ValueError): rc = -1
+        usage = json.loads(form.getvalue('usage') or '{}') or {}
+        self.sendOK(json.dumps({ "ok": job_queue.complete(jobid, lease, rc, usage) }))
+
     #remove data dir from library
     def post_rmdir(self, form):
         jobid = self.check_id(form)
         job_queue.terminate(jobid)
         dirpath = joinp(datadir, jobid, d=datadir) #confinment check
-        shutil.rmtree(dirpath)
+        dirsize = remove_dir(dirpath)
+        metadata_store.forget(dirpath)
+        job_catalog.remove(jobid)
+        disk_usage.add(-dirsize)
         self.sendOK('Deleted: '+jobid)
 
     #kill a running job
@@ -512,27 +1752,590 @@ class plineServer(BaseHTTPRequestHandler):
         self.sendOK('Resumed: '+jobid)
 
     #handle POST request
-    def do_POST(self):
+    def serve_post(self):
+        form = None
+        action = ''
         try:
-            form = cgi.FieldStorage(fp = self.rfile, headers = self.headers, environ={'REQUEST_METHOD': 'POST'})
+            form = Form(self.rfile, self.headers, maxpart=filelimit*(10**6), maxsize=datalimit*(10**6))
             action = form.getvalue('action', '')
             logging.debug("POST: %s" % action)
 
             if not action:
                 raise AttributeError("request type missing")
+            self.action = action if hasattr(self, "post_%s" % action) else 'invalid'
             getattr(self, "post_%s" % action)(form) #run the request
 
-        except IOError as e:
+        except Exception as e:
+            self.send_failure(e, action)
+        finally:
+            if form: form.close()
+
+    #send the error response of a failed request (POST and GET mirrors)
+    def send_failure(self, e, action):
+        if self.status_code: #(response already started, e.g. a stream)
+            logging.debug("Request %s failed after the response was started: %s" % (action, e))
+        elif isinstance(e, SizeLimitError):
+            self.sendError(413, str(e), action)
+        elif isinstance(e, IOError):
             if hasattr(e, 'reason'): self.sendError(404, "URL does not exist. %s" % e.reason, action)
             else: self.sendError(404, str(e), action)
-        except shutil.Error as why:
-            self.sendError(501,"File operation failed: %s" % why)
-        except OSError as e:
+        elif isinstance(e, shutil.Error):
+            self.sendError(501,"File operation failed: %s" % e)
+        elif isinstance(e, OSError):
             self.sendError(501,"System error. %s" % e.strerror, action)
-        except AttributeError as e:
-            self.sendError(501, "Invalid POST request. %s" % e, action)
-        except Exception as e:
-            logging.exception("Runtime error in POST request: %s" % e)
+        elif isinstance(e, AttributeError):
+            self.sendError(501, "Invalid %s request. %s" % (self.command, e), action)
+        else:
+            logging.exception("Runtime error in %s request: %s" % (self.command, e))
+            self.sendError(500, "Server error", action, skiplog=True)
+
+#reads the last lines of log files (backwards from the file end; cached by file size & mtime)
+class LogTail(object):
+    MAXLINE = 64*1024 #max. length of the returned line
+
+    def __init__(self, maxfiles=5000):
+        self.cache = OrderedDict() #filepath => (mtime, size, line offset, last line)
+        self.maxfiles = maxfiles
+        self.lock = threading.Lock()
+
+    def last_line(self, fpath): #=> last line (None for missing/empty files, '' for binary files)
+        try: st = os.stat(fpath)
+        except OSError: return None
+        if not st.st_size: return None
+        with self.lock:
+            cached = self.cache.get(fpath)
+            if cached and cached[:2] == (st.st_mtime, st.st_size): #file unchanged
+                self.cache[fpath] = self.cache.pop(fpath) #mark as recently used
+                logging.debug("Log tail %s: cached (0 bytes read)" % fpath)
+                return cached[3]
+        try:
+            with open(fpath, 'rb') as f:
+                (offset, line, nread) = self.read_tail(f, st.st_size)
+        except (OSError, IOError):
+            return None
+        try:
+            line = line.decode('utf-8', 'ignore' if offset > 0 and nread >= LogTail.MAXLINE else 'strict')
+            json.dumps(line) #test if serializable
+        except (TypeError, UnicodeDecodeError): #not a text file
+            line = ''
+        logging.debug("Log tail %s: read %d bytes" % (fpath, nread))
+        with self.lock:
+            self.cache[fpath] = (st.st_mtime, st.st_size, offset, line)
+            while len(self.cache) > self.maxfiles: self.cache.popitem(last=False)
+        return line
+
+    def read_tail(self, f, size): #=> (line offset, last line, nr. of bytes read)
+        tail = b''
+        pos = size
+        while pos > 0:
+            step = min(blocksize, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            end = len(tail) #skip the line break at the file end (universal newlines)
+            if tail.endswith(b'\r\n'): end -= 2
+            elif tail.endswith(b'\n') or tail.endswith(b'\r'): end -= 1
+            start = max(tail.rfind(b'\n', 0, end), tail.rfind(b'\r', 0, end))
+            if start >= 0:
+                start = max(start+1, end-LogTail.MAXLINE) #(cap long lines)
+                return (pos+start, tail[start:end], size-pos)
+            if end > LogTail.MAXLINE: #very long line: return its end
+                return (pos+end-LogTail.MAXLINE, tail[end-LogTail.MAXLINE:end], size-pos)
+        return (0, tail[:end], size)
+
+log_tails = LogTail()
+
+#publishes job status changes to the subscribed clients (server-sent events)
+class EventBus(object):
+    def __init__(self, maxevents=10000):
+        self.events = deque(maxlen=maxevents) #(seq. nr., jobid, status data)
+        self.seq = 0
+        self.cond = threading.Condition()
+
+    def publish(self, jobid, data):
+        with self.cond:
+            self.seq += 1
+            self.events.append((self.seq, jobid, data))
+            self.cond.notify_all()
+
+    #wait for new events => (last seq. nr., [(seq, jobid, data), ...]); jobids includes pipeline steps
+    def wait(self, since, jobids, timeout=None):
+        def matches(jobid):
+            for sub in jobids:
+                if jobid == sub or jobid.startswith(sub+'/'): return True
+            return False
+        with self.cond:
+            if self.seq <= since: self.cond.wait(timeout)
+            found = [ev for ev in self.events if ev[0] > since and matches(ev[1])]
+            return (self.seq, found)
+
+job_events = EventBus()
+
+#in-process counters and histograms (rendered in Prometheus text format)
+class Metrics(object):
+    HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    JOB_BUCKETS = (1, 5, 15, 60, 300, 900, 3600, 4*3600, 12*3600, 86400)
+    HELP = {
+        'pline_http_requests_total': ('counter', 'HTTP requests by action, method and response code'),
+        'pline_http_request_duration_seconds': ('histogram', 'HTTP request handling time by action'),
+        'pline_jobs_finished_total': ('counter', 'Finished jobs by plugin and exit status'),
+        'pline_job_duration_seconds': ('histogram', 'Job running time by plugin and exit status'),
+        'pline_job_queue_wait_seconds': ('histogram', 'Time from queueing to job start'),
+        'pline_queue_jobs': ('gauge', 'Jobs in the work queue by state'),
+        'pline_queue_oldest_wait_seconds': ('gauge', 'Queue wait of the longest waiting job'),
+        'pline_workers': ('gauge', 'Job worker threads by state'),
+        'pline_worker_pool': ('gauge', 'Worker pool size and its bounds'),
+        'pline_worker_resizes_total': ('counter', 'Worker pool size changes by direction'),
+        'pline_cores': ('gauge', 'CPU core budget for jobs by state'),
+        'pline_memory_megabytes': ('gauge', 'Memory budget for jobs by state'),
+        'pline_datadir_bytes': ('gauge', 'Size of the data directory'),
+        'pline_uptime_seconds': ('gauge', 'Time since server start')
+    }
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {} #(name, labels) => value
+        self.histograms = {} #(name, labels) => [bucket limits, bucket counts, sum]
+        self.lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name, value, labels=(), buckets=HTTP_BUCKETS):
+        with self.lock:
+            hist = self.histograms.get((name, labels))
+            if not hist: hist = self.histograms[(name, labels)] = [buckets, [0]*(len(buckets)+1), 0.0]
+            i = 0
+            while i < len(buckets) and value > buckets[i]: i += 1
+            hist[1][i] += 1
+            hist[2] += value
+
+    @staticmethod
+    def labelstr(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels: return ''
+        esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{%s}' % ','.join(['%s="%s"' % (k, esc(v)) for (k, v) in labels])
+
+    def render(self): #=> metrics text
+        gauges = [('pline_uptime_seconds', (), round(time.time()-self.started, 1))]
+        if job_queue:
+            cap = job_queue.capacity()
+            workers = job_queue.size
+            gauges += [('pline_queue_jobs', (('state', 'queued'),), cap['queued']), ('pline_queue_jobs', (('state', 'running'),), cap['running']),
+                ('pline_queue_oldest_wait_seconds', (), round(cap['waiting'], 1)),
+                ('pline_workers', (('state', 'busy'),), cap['running']), ('pline_workers', (('state', 'idle'),), max(workers-cap['running'], 0)),
+                ('pline_worker_pool', (('bound', 'size'),), workers), ('pline_worker_pool', (('bound', 'min'),), job_queue.minworkers),
+                ('pline_worker_pool', (('bound', 'max'),), job_queue.maxworkers),
+                ('pline_cores', (('state', 'used'),), cap['used']['cores']), ('pline_cores', (('state', 'total'),), cap['cores'])]
+            if cap['memory']:
+                gauges += [('pline_memory_megabytes', (('state', 'used'),), cap['used']['memory']), ('pline_memory_megabytes', (('state', 'total'),), cap['memory'])]
+        if disk_usage: gauges.append(('pline_datadir_bytes', (), disk_usage.size()))
+        lines = []
+        def header(name):
+            if name not in described and name in Metrics.HELP:
+                lines.append('# HELP %s %s' % (name, Metrics.HELP[name][1]))
+                lines.append('# TYPE %s %s' % (name, Metrics.HELP[name][0]))
+                described.add(name)
+        described = set()
+        for (name, labels, value) in gauges:
+            header(name)
+            lines.append('%s%s %s' % (name, Metrics.labelstr(labels), value))
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted([(k, (v[0], list(v[1]), v[2])) for (k, v) in self.histograms.items()])
+        for ((name, labels), value) in counters:
+            header(name)
+            lines.append('%s%s %s' % (name, Metrics.labelstr(labels), value))
+        for ((name, labels), (buckets, counts, total)) in histograms:
+            header(name)
+            cumulative = 0
+            for (limit, count) in zip(list(buckets)+['+Inf'], counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (name, Metrics.labelstr(labels, (('le', limit),)), cumulative))
+            lines.append('%s_sum%s %s' % (name, Metrics.labelstr(labels), round(total, 6)))
+            lines.append('%s_count%s %d' % (name, Metrics.labelstr(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+#SQLite index of the jobs in the data dir (mirrors the job.json files)
+class JobCatalog(object):
+    FIELDS = ('status', 'created', 'completed', 'email', 'keepData', 'nextstep', 'size', 'name')
+
+    def __init__(self, dbpath):
+        self.lock = threading.Lock()
+        isnew = not os.path.isfile(dbpath)
+        self.db = sqlite3.connect(dbpath, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, root TEXT, name TEXT, status,
+            created INTEGER, completed INTEGER, updated REAL, email TEXT, keepData INTEGER, nextstep TEXT, size INTEGER)''')
+        for col in ('root', 'status', 'created', 'updated', 'email'):
+            self.db.execute('CREATE INDEX IF NOT EXISTS jobs_%s ON jobs (%s)' % (col, col))
+        self.db.execute('CREATE TABLE IF NOT EXISTS access (root TEXT PRIMARY KEY, accessed REAL)') #last download/status request
+        self.db.execute('''CREATE TABLE IF NOT EXISTS usage (id TEXT, completed INTEGER, plugin TEXT, program TEXT, exitcode INTEGER,
+            wall REAL, cpu REAL, maxrss REAL, queuewait REAL, outsize INTEGER, PRIMARY KEY (id, completed))''') #(kept after job removal)
+        if isnew: self.rebuild()
+
+    def upsert(self, fpath, md, mtime=None): #add/update a job (from its metadata file)
+        if mtime is None: mtime = os.path.getmtime(fpath)
+        with self.lock: self._upsert(fpath, md, mtime)
+
+    def _upsert(self, fpath, md, mtime): #(called with self.lock)
+        jobid = os.path.relpath(os.path.dirname(fpath), datadir).replace(os.sep, '/')
+        row = [md.get(f) for f in JobCatalog.FIELDS]
+        row[JobCatalog.FIELDS.index('keepData')] = 1 if md.get('keepData') else 0
+        self.db.execute('INSERT OR REPLACE INTO jobs (id, root, updated, %s) VALUES (?, ?, ?, %s)' %
+            (', '.join(JobCatalog.FIELDS), ', '.join(['?']*len(JobCatalog.FIELDS))), [jobid, jobid.split('/')[0], mtime] + row)
+        usage = md.get('usage')
+        if usage and md.get('completed'): #resource usage of a finished job
+            self.db.execute('INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [jobid, md['completed'], md.get('plugin'), md.get('program'),
+                usage.get('exitcode'), usage.get('wall'), usage.get('cpu'), usage.get('maxrss'), usage.get('queuewait'), usage.get('outsize')])
+
+    def remove(self, jobid): #remove a job and its subdirs (pipeline steps)
+        with self.lock:
+            self.db.execute('DELETE FROM jobs WHERE id = ? OR substr(id, 1, ?) = ?', (jobid, len(jobid)+1, jobid+'/'))
+            self.db.execute('DELETE FROM access WHERE root = ?', (jobid,))
+
+    def get(self, jobid):
+        with self.lock:
+            row = self.db.execute('SELECT * FROM jobs WHERE id = ?', (jobid,)).fetchone()
+        return dict(row) if row else {}
+
+    def query(self, status=None, email=None, since=0, until=0, limit=1000): #list jobs (newest first)
+        where, args = [], []
+        if status is not None:
+            where.append('status = ?')
+            args.append(status)
+        if email:
+            where.append('email = ?')
+            args.append(email)
+        if since:
+            where.append('created >= ?')
+            args.append(since)
+        if until:
+            where.append('created < ?')
+            args.append(until)
+        sql = 'SELECT * FROM jobs%s ORDER BY created DESC LIMIT ?' % (' WHERE '+' AND '.join(where) if where else '')
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, args+[limit])]
+
+    def usage_report(self, since=0): #resource usage summary per plugin and program (highest CPU use first)
+        sql = '''SELECT plugin, program, COUNT(*) AS jobs, SUM(exitcode != 0) AS failed, AVG(wall) AS wall_avg, MAX(wall) AS wall_max,
+            SUM(cpu) AS cpu_total, AVG(cpu) AS cpu_avg, AVG(maxrss) AS maxrss_avg, MAX(maxrss) AS maxrss_max,
+            AVG(queuewait) AS queuewait_avg, MAX(queuewait) AS queuewait_max, AVG(outsize) AS outsize_avg
+            FROM usage WHERE completed >= ? GROUP BY plugin, program ORDER BY cpu_total DESC'''
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, (since,))]
+
+    def roots(self, before=0): #top-level job dirs (excl. keepData), oldest first => [(dirname, last update, email)]
+        sql = 'SELECT root, MAX(updated) AS edited, MAX(email) FROM jobs GROUP BY root HAVING MAX(keepData) = 0'
+        if before: sql += ' AND edited < %f' % before
+        with self.lock:
+            return [tuple(row) for row in self.db.execute(sql+' ORDER BY edited')]
+
+    def root(self, dirname): #=> (last update, email) of a top-level job dir (None if missing or keepData)
+        with self.lock:
+            row = self.db.execute('SELECT MAX(updated), MAX(email) FROM jobs WHERE root = ? GROUP BY root HAVING MAX(keepData) = 0', (dirname,)).fetchone()
+        return tuple(row) if row else None
+
+    def lru_roots(self): #top-level job dirs (excl. keepData), least recently updated or accessed first => [(dirname, last use)]
+        sql = '''SELECT jobs.root, MAX(MAX(jobs.updated), IFNULL(MAX(access.accessed), 0)) AS used FROM jobs
+            LEFT JOIN access ON access.root = jobs.root GROUP BY jobs.root HAVING MAX(keepData) = 0 ORDER BY used'''
+        with self.lock:
+            return [tuple(row) for row in self.db.execute(sql)]
+
+    def touch(self, accessed): #record access times {root: time}
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO access (root, accessed) SELECT ?, ? WHERE EXISTS (SELECT 1 FROM jobs WHERE root = ?)',
+                [(root, t, root) for (root, t) in accessed.items()])
+
+    def rebuild(self, path=datadir): #recreate the catalog from the job.json files
+        started = time.time()
+        rows = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            if Metadata.FILE not in filenames or dirpath == path: continue
+            fpath = os.path.join(dirpath, Metadata.FILE)
+            try:
+                with open(fpath) as f: rows.append((fpath, json.load(f), os.path.getmtime(fpath)))
+            except (OSError, IOError, ValueError) as e:
+                logging.error('Catalog: skipped %s (%s)' % (fpath, e))
+        with self.lock: #(one transaction: other writers wait)
+            self.db.execute('BEGIN')
+            try:
+                self.db.execute('DELETE FROM jobs')
+                for (fpath, md, mtime) in rows: self._upsert(fpath, md, mtime)
+            except:
+                self.db.execute('ROLLBACK') #keep the old catalog
+                raise
+            self.db.execute('COMMIT')
+        info('Job catalog: indexed %d jobs in %.1fs' % (len(rows), time.time()-started))
+
+#outputs of finished jobs, keyed by a hash of the command, plugin files and input files
+#(files are hardlinked between the cache and job dirs; entries are evicted by size in LRU order)
+class ResultCache(object):
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, path, maxsize, catalog):
+        self.path = path
+        self.maxsize = maxsize
+        self.catalog = catalog #index of cache entries (shared sqlite db)
+        if not os.path.isdir(path): os.makedirs(path, 0o775)
+        for dirname in os.listdir(path): #remove unfinished entries
+            if dirname.startswith('.tmp'): shutil.rmtree(os.path.join(path, dirname), ignore_errors=True)
+        with catalog.lock:
+            catalog.db.execute('''CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, size INTEGER,
+                created REAL, used REAL, hits INTEGER DEFAULT 0, program TEXT)''')
+            catalog.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+
+    @staticmethod
+    def files(jobdir): #=> {relative path: (size, mtime)} of the job files (excl. pipeline step dirs)
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(jobdir):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.') and not os.path.isfile(os.path.join(dirpath, d, Metadata.FILE))]
+            for fname in filenames:
+                if fname == Metadata.FILE or fname.startswith('.'): continue
+                fpath = os.path.join(dirpath, fname)
+                try: st = os.stat(fpath)
+                except OSError: continue
+                found[os.path.relpath(fpath, jobdir)] = (st.st_size, st.st_mtime)
+        return found
+
+    @staticmethod
+    def filehash(fpath):
+        h = hashlib.sha256()
+        with open(fpath, 'rb') as f:
+            for chunk in iter(lambda: f.read(blocksize), b''): h.update(chunk)
+        return h.hexdigest()
+
+    def key(self, job): #=> cache key of a job ('' = not cacheable)
+        plugins = job["plugin"].split('|')
+        if any([plugin_registry.plugin_json(p).get('cache') is False for p in plugins]): return ''
+        h = hashlib.sha256()
+        for part in (job.bin, job["parameters"], job["stdout"], job["logfile"]): #resolved command
+            h.update(part.encode('utf-8') + b'\0')
+        for plugin in plugins: #plugin version
+            h.update(ResultCache.filehash(os.path.join(plugindir, plugin)).encode() + b'\0')
+        for program in job.bin.split('|'): #plugin-provided executables
+            cmd = program.split(' ')[0]
+            if os.path.isfile(cmd):
+                st = os.stat(cmd)
+                h.update(('%s %d %d\0' % (cmd, st.st_size, int(st.st_mtime))).encode('utf-8'))
+        for name in job.inputs():
+            h.update(('%s\0%s\0' % (name, ResultCache.filehash(os.path.join(job.jobdir, name)))).encode('utf-8'))
+        return h.hexdigest()
+
+    def link(self, src, dst): #hardlink (or copy) a file
+        dstdir = os.path.dirname(dst)
+        if not os.path.isdir(dstdir): os.makedirs(dstdir, 0o775)
+        try: os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+            os.chmod(dst, 0o664) #(private copy)
+            disk_usage.add(os.path.getsize(dst))
+
+    def unshare(self, jobdir): #replace cached files in a job dir with private copies (before the job rewrites its outputs)
+        for name in ResultCache.files(jobdir):
+            fpath = os.path.join(jobdir, name)
+            try:
+                st = os.stat(fpath)
+                if st.st_nlink < 2 or st.st_mode & 0o200 or (blob_store and blob_store.stored(st.st_ino)): continue
+                tmp = os.path.join(os.path.dirname(fpath), '.unshare.'+os.path.basename(fpath))
+                shutil.copy2(fpath, tmp)
+                os.chmod(tmp, 0o664)
+                os.rename(tmp, fpath)
+                disk_usage.add(st.st_size)
+            except (IOError, OSError) as e:
+                logging.error("Result cache: failed to copy %s: %s" % (fpath, e))
+
+    def restore(self, key, jobdir): #fill the job dir from a cache entry => manifest (None if not cached)
+        entry = os.path.join(self.path, key)
+        try:
+            with open(os.path.join(entry, ResultCache.MANIFEST)) as f: manifest = json.load(f)
+            for name, (size, mtime) in manifest['files'].items(): #check the cached files are intact
+                st = os.stat(os.path.join(entry, name))
+                if (st.st_size, int(st.st_mtime)) != (size, int(mtime)): raise ValueError('Modified cache file: '+name)
+            for name in manifest['files']:
+                dst = os.path.join(jobdir, name)
+                if os.path.lexists(dst): os.remove(dst)
+                self.link(os.path.join(entry, name), dst)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            if os.path.isdir(entry):
+                logging.debug("Result cache: dropping entry %s (%s)" % (key[:16], e))
+                self.remove(key)
+            return None
+        with self.catalog.lock:
+            self.catalog.db.execute('UPDATE results SET used = ?, hits = hits+1 WHERE key = ?', (time.time(), key))
+        return manifest
+
+    def store(self, key, jobdir, before, program=''): #add the new/changed files of a finished job
+        entry = os.path.join(self.path, key)
+        if os.path.isdir(entry): return
+        after = ResultCache.files(jobdir)
+        outputs = dict([(name, st) for (name, st) in after.items() if before.get(name) != st])
+        size = sum([st[0] for st in outputs.values()])
+        if size > self.maxsize: return
+        tmpdir = tempfile.mkdtemp(prefix='.tmp', dir=self.path)
+        try:
+            for name in outputs: #(read-only: shared with the job dirs)
+                self.link(os.path.join(jobdir, name), os.path.join(tmpdir, name))
+                os.chmod(os.path.join(tmpdir, name), 0o444)
+            with open(os.path.join(tmpdir, ResultCache.MANIFEST), 'w') as f:
+                json.dump({ "files": outputs, "program": program, "created": time.time() }, f)
+            os.chmod(tmpdir, 0o775)
+            os.rename(tmpdir, entry)
+        except (IOError, OSError) as e:
+            logging.error("Result cache: failed to store %s: %s" % (jobdir, e))
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+        now = time.time()
+        with self.catalog.lock:
+            self.catalog.db.execute('INSERT OR REPLACE INTO results (key, size, created, used, program) VALUES (?, ?, ?, ?, ?)', (key, size, now, now, program))
+        logging.debug("Result cache: stored %d files (%d bytes) as %s" % (len(outputs), size, key[:16]))
+        self.evict()
+
+    def remove(self, key): #(files still linked from job dirs are freed with the job dir)
+        try: disk_usage.add(-remove_dir(os.path.join(self.path, key)))
+        except OSError: pass
+        with self.catalog.lock:
+            self.catalog.db.execute('DELETE FROM results WHERE key = ?', (key,))
+
+    def evict(self): #remove least recently used entries over the size limit
+        with self.catalog.lock:
+            total = self.catalog.db.execute('SELECT SUM(size) FROM results').fetchone()[0] or 0
+            if total <= self.maxsize: return
+            entries = self.catalog.db.execute('SELECT key, size FROM results ORDER BY used').fetchall()
+        for (key, size) in entries:
+            if total <= self.maxsize: break
+            self.remove(key)
+            total -= size
+            logging.debug("Result cache: evicted %s" % key[:16])
+
+#cached job.json record
+class MetaRecord(object):
+    def __init__(self, data, mtime=0):
+        self.data = data
+        self.mtime = mtime #file timestamp at last read/write
+        self.dirty = False #changes waiting to be written
+        self.since = 0 #time of the oldest unwritten change
+        self.version = 0
+
+#shared in-memory store for job metadata (LRU cache validated by file mtime; coalesced writes)
+class MetadataStore(object):
+    def __init__(self, maxitems=2000, delay=1.0):
+        self.records = OrderedDict() #filepath => MetaRecord
+        self.maxitems = maxitems
+        self.delay = delay #seconds to collect changes before writing the file
+        self.lock = threading.Lock()
+        self.wlock = threading.Lock() #serializes file writes
+        self.pending = threading.Event()
+        self.flusher = None
+        self.onsave = None #callback(filepath, metadata, timestamp) for metadata changes
+
+    def load(self, fpath): #=> copy of the metadata dict
+        with self.lock:
+            rec = self.records.get(fpath)
+            if rec and rec.dirty:
+                self.records[fpath] = self.records.pop(fpath)
+                return dict(rec.data)
+        mtime = os.stat(fpath).st_mtime
+        if rec and rec.mtime == mtime: #file unchanged
+            with self.lock:
+                if fpath in self.records: self.records[fpath] = self.records.pop(fpath)
+            return dict(rec.data)
+        with open(fpath) as f:
+            data = json.load(f)
+        with self.lock:
+            rec = self.records.get(fpath)
+            if not rec or not rec.dirty:
+                self.records[fpath] = MetaRecord(data, mtime)
+            else: data = rec.data
+            self.records[fpath] = self.records.pop(fpath)
+        self._evict()
+        return dict(data)
+
+    def save(self, fpath, data, sync=False): #store changes (written to file after a short delay)
+        with self.lock:
+            rec = self.records.pop(fpath, None) or MetaRecord({})
+            rec.data = dict(data)
+            rec.version += 1
+            if not rec.dirty:
+                rec.dirty = True
+                rec.since = time.time()
+            self.records[fpath] = rec
+        if self.onsave:
+            try: self.onsave(fpath, data, time.time())
+            except Exception as e: logging.error("Metadata save callback failed: %s" % e)
+        if sync: self.write(fpath)
+        else:
+            self._start()
+            self.pending.set()
+        self._evict()
+
+    def write(self, fpath): #write the pending changes to file (atomic replace)
+        with self.wlock:
+            with self.lock:
+                rec = self.records.get(fpath)
+                if not rec or not rec.dirty: return
+                version = rec.version
+                mdjson = json.dumps(rec.data, indent=2)
+            dirpath = os.path.dirname(fpath)
+            try:
+                with tempfile.NamedTemporaryFile(mode='w', suffix=os.path.basename(fpath), prefix='', dir=dirpath, delete=False) as f:
+                    f.write(mdjson)
+                os.chmod(f.name, 0o664)
+                os.rename(f.name, fpath)
+                mtime = os.stat(fpath).st_mtime
+            except (OSError, IOError) as e: #jobdir removed
+                logging.debug("Metadata write failed: %s" % e)
+                with self.lock: self.records.pop(fpath, None)
+                return
+            with self.lock:
+                rec.mtime = mtime
+                if rec.version == version: rec.dirty = False
+
+    def flush(self, maxage=0): #write changes older than maxage (seconds)
+        now = time.time()
+        with self.lock:
+            dirty = [fpath for (fpath, rec) in self.records.items() if rec.dirty and now-rec.since >= maxage]
+        for fpath in dirty: self.write(fpath)
+
+    def forget(self, dirpath): #drop the records of a removed directory
+        with self.lock:
+            for fpath in list(self.records.keys()):
+                if fpath.startswith(os.path.join(dirpath, '')): del self.records[fpath]
+
+    def _evict(self): #limit the cache size (oldest first; changes are written out)
+        while len(self.records) > self.maxitems:
+            with self.lock:
+                (fpath, rec) = next(iter(self.records.items()))
+            if rec.dirty: self.write(fpath)
+            with self.lock:
+                if fpath in self.records and not self.records[fpath].dirty: del self.records[fpath]
+
+    def _start(self): #launch the background writer thread
+        if self.flusher: return
+        with self.lock:
+            if self.flusher: return
+            self.flusher = threading.Thread(target=self._flush_loop)
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self.pending.wait()
+            self.pending.clear()
+            time.sleep(self.delay) #collect more changes
+            try: self.flush(self.delay)
+            except Exception as e: logging.error("Metadata flush failed: %s" % e)
+            with self.lock:
+                if any([rec.dirty for rec in self.records.values()]): self.pending.set()
+
+metadata_store = MetadataStore()
 
 #class for handling metadata files in job directories
 class Metadata(object):
@@ -547,11 +2350,11 @@ class Metadata(object):
         if not os.path.isdir(self.jobdir):
             raise IOError('Metadata: invalid jobdir: '+jobid)
         self.md_file = os.path.join(self.jobdir, filename)
-        if not os.path.exists(self.md_file):
-            raise IOError('Metadata: '+filename+' missing from jobdir: '+jobid)
         
         try:
-            self.metadata = json.load(open(self.md_file))
+            self.metadata = metadata_store.load(self.md_file)
+        except (OSError, IOError):
+            raise IOError('Metadata: '+filename+' missing from jobdir: '+jobid)
         except ValueError:
             try:
                 os.rename(self.md_file, self.md_file+".corrupted")
@@ -606,15 +2409,11 @@ class Metadata(object):
             self.metadata = data
             self.flush()
     
-    def flush(self):  #write metadata to file
-        fn = os.path.basename(self.md_file)
-        with tempfile.NamedTemporaryFile(mode='w', suffix=fn, prefix='', dir=self.jobdir, delete=False) as f:
-            json.dump(self.metadata, f, indent=2)
-            os.chmod(f.name, 0o664)
-            os.rename(f.name, self.md_file)
+    def flush(self, sync=False):  #write metadata to file (after a short delay)
+        metadata_store.save(self.md_file, self.metadata, sync)
     
     def update_log(self):  #add log output to metadata object
-        if not job_queue.get(self["id"]) and self["status"] in (Job.INIT, Job.QUEUED, Job.RUNNING): #broken job
+        if not job_queue.get(self["id"]) and not self["waiting"] and self["status"] in (Job.INIT, Job.QUEUED, Job.RUNNING): #broken job
             self.update("status", Job.FAIL) #update datafile
         self["log"] = self.last_log_line() #not written to datafile
         try:
@@ -623,25 +2422,11 @@ class Metadata(object):
             self["updated"] = int(time.time())
     
     def last_log_line(self): #read last line from the log file
-        fpath = self.logfile or self.stdout
-        try:
-            if(not os.path.isfile(fpath) or not os.path.getsize(fpath)):
-                if(fpath is self.logfile): fpath = self.stdout
-                else: return ''
-            logfile = open(fpath)
-        except (OSError, IOError):
-            return ''
-        
-        lastLine = ''
-        try:
-            for line in logfile:
-                lastLine = line
-            json.dumps(lastLine) #test if serializable
-            lastLine = lastLine.strip().replace(self.jobdir, "jobPath") #remove full path
-        except (TypeError, UnicodeDecodeError): #not a text file
-            lastLine = ''
-        logfile.close()
-        return lastLine
+        lastLine = log_tails.last_line(self.logfile) if self.logfile else None
+        if lastLine is None and self.stdout: #no error log: use stdout
+            lastLine = log_tails.last_line(self.stdout)
+        if not lastLine: return ''
+        return lastLine.strip().replace(self.jobdir, "jobPath") #remove full path
     
     @classmethod
     def create(cls, dirpath, filename=FILE, name="unnamed"):
@@ -656,34 +2441,44 @@ class Metadata(object):
             "logfile": "err.log",
         }
         fpath = joinp(datadir, dirpath, filename)
-        with open(fpath, 'w') as mdfile:
-            mdfile.write(json.dumps(md, indent=2))
-        os.chmod(fpath, 0o664)
+        metadata_store.save(fpath, md, sync=True)
         return cls(dirpath, filename) #cls=Metadata()
 
 #class for creating queued jobs
 class Job(object):
     INIT, QUEUED, RUNNING, SUCCESS, FAIL, TERMINATED = [1, 1, 2, 0, -1, -15]
+    errormsg = {
+        -1  : "See log file",
+        -11 : "Segmentation fault",
+        -14 : "Terminated: running time limit exceeded",
+        -15 : "Terminated by user",
+        -16 : "Terminated by server",
+        -17 : "Finished, exit status unknown (server restarted)",
+        -24 : "Terminated: CPU time limit exceeded",
+        -25 : "Terminated: file size limit exceeded",
+        127 : "Executable not found"
+    }
+    UNKNOWN = -17 #re-adopted job (not a child process of this server)
+    CANCELLED = "Cancelled: a previous step failed"
+    graph_lock = threading.Lock() #pipeline steps are started one finished step at a time
 
-    def __init__(self, jobid):
+    def __init__(self, jobid, pgid=0): #pgid: process group of a job started before a server restart
         
         md = Metadata(jobid)
         self.jobid = jobid
         self.jobdir = md.jobdir
         self.items = md.metadata
         
-        self.errormsg = {
-            -1  : "See log file",
-            -11 : "Segmentation fault",
-            -15 : "Terminated by user",
-            -16 : "Terminated by server",
-            127 : "Executable not found"
-        }
-        
         self.job_status = self["status"] = Job.INIT
+        del self["waiting"]
         self.lock = threading.Lock() #thread syncing lock
         self.bin = self["program"] #keeps full dirpath
         self.popen = None
+        self.procs = [] #piped job processes
+        self.pgid = 0 #process group of the job processes
+        self.ended = False #job processes collected by wait()
+        self.timedout = False
+        self.resume = False #stopped by server shutdown (restarted with the server)
         self.postprocess = None
         
         self["updated"] = int(time.time())
@@ -695,12 +2490,21 @@ class Job(object):
         if(len(plugins) != len(programs)):
             raise IOError("Plugin/program count mismatch")
 
+        params = self["parameters"].split('|')
+        self.cores = self.memory = 0 #reserved resources (piped programs run in parallel)
         for i, plugin in enumerate(plugins):
             pluginfile = joinp(plugindir, plugin, d=plugindir)
             if(not os.path.isfile(pluginfile)): raise IOError('Invalid plugin file: '+plugin)
             programs[i] = self.check_exec(plugin, programs[i]) #check binary path
+            (cores, memory) = plugin_registry.resources(plugin, params[i] if i < len(params) else '')
+            self.cores += cores
+            self.memory += memory
         
         self.bin = '|'.join(programs)
+        self["resources"] = { "cores": self.cores, "memory": self.memory }
+        self.owner = self["owner"] or 'local'
+        self.priority = Workqueue.PRIORITY.get(self["priority"], 1)
+        self.queued = self.started = 0
 
         #windows: replace path separators in params
         if(os.sep != '/'):
@@ -710,33 +2514,26 @@ class Job(object):
                 params[i] = param
             self["parameters"] = ' '.join(self.params)
 
-        self.update() #update datafile
-        job_queue.enqueue(jobid, self) #add itself to the queue
+        self.flush() #update datafile
+        if pgid: job_queue.adopt(jobid, self, pgid) #still running
+        else: job_queue.enqueue(jobid, self) #add itself to the queue
+    
+    def inputs(self): #=> input files (relative paths): files in the job dir, listed input files and files named in the parameters
+        inputs = set([f for f in ResultCache.files(self.jobdir) if f not in (self["stdout"], self["logfile"])])
+        names = [f for f in self["infiles"].split(',') if f] + re.split(r'[\s|=,]+', self["parameters"])
+        for name in names:
+            fpath = os.path.normpath(os.path.join(self.jobdir, name.strip('"\'')))
+            if fpath.startswith(datadir+os.sep) and os.path.isfile(fpath):
+                inputs.add(os.path.relpath(fpath, self.jobdir))
+        return sorted(inputs)
+    
+    def spec(self, lease): #=> job description for a worker agent
+        spec = dict([(key, self[key]) for key in ('id', 'name', 'plugin', 'program', 'parameters', 'infiles', 'outfiles', 'stdout', 'logfile')])
+        spec.update({ "lease": lease, "files": [f.replace(os.sep, '/') for f in self.inputs()], "resources": self["resources"] })
+        return spec
     
     def check_exec(self, plugin, program): #check the program path in the plugin dir
-        pdir = os.path.dirname(os.path.join(plugindir, plugin))
-        osdirs = { #check binary location: plugin/[osx|linux|windows|.]/program
-            'darwin': 'osx',
-            'linux': 'linux',
-            'win': 'windows'
-        }
-        cmd = program.split(' ')
-        def cmdpath(fpath): #restore original command
-            cmd[0] = fpath
-            return ' '.join(cmd)
-
-        for osname in osdirs: #check os-specific subdir
-            if(sys.platform.startswith(osname)):
-                fpath = os.path.join(pdir, osdirs[osname], cmd[0])
-                if os.path.isfile(fpath) and os.access(fpath, os.X_OK):
-                    return cmdpath(fpath)
-                break
-
-        fpath = os.path.join(pdir, cmd[0]) #check plugin root
-        if os.path.isfile(fpath) and os.access(fpath, os.X_OK):
-            return cmdpath(fpath)
-
-        return program #fallback: use system command
+        return plugin_registry.exec_path(plugin, program)
     
     def __getitem__(self, key):
         try: return self.items[key]
@@ -772,21 +2569,57 @@ class Job(object):
     def done(self):
         return self["status"] not in (Job.INIT, Job.QUEUED, Job.RUNNING)
 
+    #=> function that sets the system resource limits in a job process (runs in the child before exec)
+    def limits(self, pgid=0):
+        if sys.platform.startswith("win"): return None
+        limits = [(resource.RLIMIT_NOFILE, 1000)] #limit nr. of files opened by the process
+        if(timelimit): #limit CPU time (h=>sec)
+            limits.append((resource.RLIMIT_CPU, timelimit*3600))
+        if(filelimit): #limit output file size (MB=>B)
+            limits.append((resource.RLIMIT_FSIZE, filelimit*(10**6)))
+        if(memlimit and hasattr(resource, 'RLIMIT_AS')): #limit address space (MB=>B)
+            limits.append((resource.RLIMIT_AS, memlimit*1024*1024))
+        def setup(): #(no locks or allocations: runs in the forked child of a threaded server)
+            os.setpgid(0, pgid) #start (0) or join the job process group (errors fail the job; setsid would prevent joining)
+            for (res, val) in limits: #(softlimit, hardlimit)
+                try: resource.setrlimit(res, (val, val))
+                except (ValueError, resource.error): pass
+            os.nice(5) #decrease the process priority
+        return setup
+    
+    def join_group(self, p): #check that a piped process is in the job process group (killpg must reach it)
+        try: os.setpgid(p.pid, self.pgid) #(also set by the parent: no race with the child)
+        except OSError as e:
+            if e.errno != errno.EACCES: raise #(EACCES: already joined and started the program)
+        if os.getpgid(p.pid) != self.pgid:
+            p.kill()
+            raise OSError(errno.EPERM, "%s did not join the job process group" % p.pid)
+    
+    def kill(self, sig=signal.SIGTERM): #signal all processes of the job
+        if self.pgid and hasattr(os, 'killpg'): #(no poll(): it could collect a process before wait4() gets its usage)
+            try: os.killpg(self.pgid, sig)
+            except OSError: pass #all processes ended
+        elif self.popen is not None and self.popen.poll() is None:
+            self.popen.send_signal(sig)
+    
+    def stop(self, sig=signal.SIGTERM, grace=10): #terminate the job processes (killed if still running after grace period)
+        self.kill(sig)
+        def force():
+            if self.alive(): self.kill(getattr(signal, 'SIGKILL', sig))
+        timer = threading.Timer(grace, force)
+        timer.daemon = True
+        timer.start()
+    
+    def timeout(self): #running time limit exceeded
+        logging.info("Job %s exceeded the running time limit (%d h)" % (self["id"], walllimit))
+        self.timedout = True
+        self.stop()
+    
     def process(self):
         if self.done(): return
-        
-        #set limits for system resources (for the server request thread with Popen jobs)
-        if(not sys.platform.startswith("win")):
-            try:
-                if(timelimit): #limit running time (h=>sec); (softlimit, hardlimit)
-                    resource.setrlimit(resource.RLIMIT_CPU, (timelimit*3600, timelimit*3600))
-                if(filelimit): #limit output file size (MB=>B)
-                    resource.setrlimit(resource.RLIMIT_FSIZE, (filelimit*(10**6), filelimit*(10**6))) 
-                #limit nr. of files created by the process
-                resource.setrlimit(resource.RLIMIT_NOFILE, (1000, 1000))
-            except (ValueError, resource.error) as e:
-                logging.debug("Failed to limit job resources: "+str(e))
-            os.nice(5) #decrease the process priority
+        if self.pgid: return self.watch() #(adopted job)
+        del self["usage"] #(restarted job)
+        del self["cached"]
         
         #separate piped commands & params
         programs = self.bin.split('|')
@@ -795,6 +2628,16 @@ class Job(object):
         if(not plen or plen != len(params)):
             raise IOError("Malformed pipeline command (wrong length)")
 
+        startsize = getsize(self.jobdir, subdirs=False)
+        cachekey = ''
+        if result_cache:
+            try: cachekey = result_cache.key(self)
+            except (IOError, OSError) as e: logging.debug("Result cache: no key for %s (%s)" % (self["id"], e))
+            if cachekey and self.restore(cachekey, startsize): return
+            result_cache.unshare(self.jobdir)
+            before = ResultCache.files(self.jobdir)
+        for fname in (self["stdout"], self["logfile"]): #(new files: old ones may be linked to the cache)
+            if fname and os.path.isfile(self.fullpath(fname)): os.remove(self.fullpath(fname))
         outfile = open(self.fullpath(self["stdout"]), "wb")
         errfile = open(self.fullpath(self["logfile"]), "w")
         #prevent job to inherit all parent filehandlers (buggy on windows)
@@ -808,30 +2651,129 @@ class Job(object):
             for i, program in enumerate(programs):
                 command = shlex.split(program+' '+params[i])
                 logging.debug("Job command: "+' '.join(command))
-                last = i is plen-1
-                if i is 0:
-                    p1 = Popen(command, stdout = PIPE if plen > 1 else outfile, stderr = errfile, close_fds = closef, cwd = self.jobdir)
+                last = i == plen-1
+                if i == 0: #(the first process starts the job process group)
+                    p1 = Popen(command, stdout = PIPE if plen > 1 else outfile, stderr = errfile, close_fds = closef, cwd = self.jobdir, preexec_fn = self.limits())
+                    self.pgid = 0 if sys.platform.startswith("win") else p1.pid
                 else:
-                    p2 = Popen(command, stdin = p1.stdout, stdout = outfile if last else PIPE, stderr = errfile, close_fds = closef, cwd = self.jobdir)
+                    p2 = Popen(command, stdin = p1.stdout, stdout = outfile if last else PIPE, stderr = errfile, close_fds = closef, cwd = self.jobdir, preexec_fn = self.limits(self.pgid))
                     p1.stdout.close() #detach pipe from parent (fix SIGPIPE forwarding)
                     p1 = p2
+                    if self.pgid: self.join_group(p2)
+                p1.program = os.path.basename(command[0])
+                self.procs.append(p1)
             
             self.popen = p1
-        except OSError as e:
+        except (OSError, SubprocessError) as e:
             logging.debug("Job command failed: "+str(e))
             errfile.write("Server error: "+str(e)+" when executing job: "+' '.join(command))
+            self.kill() #stop the already started commands
         else:
             self.begin()
-            ret = self.popen.wait()
+            started = time.time()
+            timer = None
+            if(walllimit): #limit running time (h=>sec)
+                timer = threading.Timer(walllimit*3600, self.timeout)
+                timer.daemon = True
+                timer.start()
+            ret = self.wait()
+            if timer: timer.cancel()
+            if self.timedout: ret = -14
+            self["usage"] = self.usage(started, ret)
+            if cachekey and ret == 0:
+                outfile.close()
+                errfile.close()
+                result_cache.store(cachekey, self.jobdir, before, self["program"])
         finally:
             outfile.close()
             errfile.close()
+            self["size"] = getsize(self.jobdir, subdirs=False)
+            if self["usage"]: self["usage"]["outsize"] = self["size"] - startsize
             self.end(ret)
+            disk_usage.add(self["size"] - startsize) #register output files
 
+    def restore(self, cachekey, startsize): #fill the job dir with cached results of an identical job
+        manifest = result_cache.restore(cachekey, self.jobdir)
+        if manifest is None: return False
+        logging.debug("Result cache: %s restored from %s" % (self["id"], cachekey[:16]))
+        self.begin()
+        self["cached"] = cachekey
+        self["usage"] = { "wall": 0, "queuewait": round(time.time()-self.queued, 3) if self.queued else 0, "exitcode": 0, "cached": True }
+        self["size"] = getsize(self.jobdir, subdirs=False)
+        self["usage"]["outsize"] = self["size"] - startsize
+        self.end(0) #(linked files are already counted, copies are added by the cache)
+        return True
+    
+    def watch(self): #follow the processes of a job started before a server restart (until they exit)
+        logging.info("Job %s: re-adopted running processes (group %d)" % (self["id"], self.pgid))
+        self.begin()
+        timer = None
+        if(walllimit): #(remaining running time)
+            timer = threading.Timer(max(walllimit*3600-(time.time()-self.started), 0), self.timeout)
+            timer.daemon = True
+            timer.start()
+        while self.alive(): time.sleep(1)
+        if timer: timer.cancel()
+        #(the exit status of processes that are not children of this server is not available: not a success)
+        ret = -14 if self.timedout else Job.UNKNOWN
+        self["usage"] = { "wall": round(time.time()-self.started, 3), "queuewait": round(self.started-self.queued, 3),
+            "exitcode": None, "adopted": True }
+        self["size"] = getsize(self.jobdir, subdirs=False)
+        self.end(ret)
+    
+    def alive(self): #any job process running?
+        if self.ended: return False
+        if not hasattr(os, 'killpg'): return self.popen is not None and self.popen.poll() is None
+        if not self.pgid: return False
+        try: os.killpg(self.pgid, 0)
+        except OSError as e: return e.errno == errno.EPERM
+        return True
+    
+    def wait(self): #wait for all the piped processes => exit code of the last process
+        if not hasattr(os, 'wait4'):
+            self.popen.wait()
+            self.ended = True
+            return self.popen.returncode
+        for p in [self.popen] + self.procs[:-1]: #(other processes end after the pipe output is closed)
+            grace = time.time()+5
+            while True:
+                try: (pid, status, ru) = os.wait4(p.pid, 0 if p is self.popen else os.WNOHANG)
+                except OSError as e:
+                    if e.errno == errno.EINTR: continue
+                    p.wait() #already collected
+                    break
+                if pid:
+                    p.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+                    p.rusage = ru
+                    break
+                if time.time() > grace: self.kill(getattr(signal, 'SIGKILL', signal.SIGTERM)) #left running
+                time.sleep(0.1)
+        self.ended = True
+        return self.popen.returncode
+    
+    def usage(self, started, rc): #resource usage of the job processes => dict
+        now = time.time()
+        usage = { "wall": round(now-started, 3), "queuewait": round(started-self.queued, 3) if self.queued else 0,
+            "exitcode": rc, "processes": [] }
+        rssunit = 1024*1024 if sys.platform == 'darwin' else 1024 #ru_maxrss: bytes (mac) or kB => MB
+        for p in self.procs:
+            ru = getattr(p, 'rusage', None)
+            if ru is None: continue
+            usage["processes"].append({ "program": p.program, "exitcode": p.returncode, "user": round(ru.ru_utime, 3),
+                "sys": round(ru.ru_stime, 3), "maxrss": round(ru.ru_maxrss/float(rssunit), 1),
+                "read": ru.ru_inblock*512, "written": ru.ru_oublock*512 }) #(block I/O in 512-byte units)
+        procs = usage["processes"]
+        if procs: #totals (piped processes run in parallel: peak memory <= sum)
+            usage["cpu"] = round(sum([p["user"]+p["sys"] for p in procs]), 3)
+            for key in ("maxrss", "read", "written"): usage[key] = sum([p[key] for p in procs])
+        return usage
+    
     def begin(self):
         with self.lock:
             self.status(Job.RUNNING)
             self.update()
+        if job_queue.journal: job_queue.journal.started(self["id"], self.pgid, self.started or time.time())
+        self.publish()
 
     def end(self, rc=-1):
         if self.done(): return
@@ -840,13 +2782,43 @@ class Job(object):
             self.status(rc, end=True)
             if(rc == 0): #job completed
                 self.check_outfiles()
-                if(self["nextstep"]):
-                    Job(self["nextstep"]) #queue the next step
-                elif(self["notify"]): #send notification email
-                    del self["notify"]
-                    if('firstid' in self.items):
-                        send_job_done(self.items.firstid)
             self.flush()
+        self.publish()
+        with Job.graph_lock: #(status is flushed: a step with many parents is started once)
+            for child in Job.children(self.items):
+                if rc != 0: Job.cancel(child, Job.CANCELLED)
+                elif Job.ready(child):
+                    try: Job(child) #queue the next step
+                    except (IOError, OSError, AttributeError) as e:
+                        logging.error("Failed to start pipeline step %s: %s" % (child, e))
+                        Metadata(child).update("status", "Error: %s" % e)
+        if rc == 0 and not Job.children(self.items): #last step: check the whole pipeline
+            with job_queue.cond: #(leaf steps finishing together: one of them sends the email)
+                root = Metadata(self["pipeline"] or self["id"])
+                notify = root['email'] and not root['notified'] and \
+                    all([Metadata(step)['status'] == Job.SUCCESS for step in (root['steps'] or [root['id']])])
+                if notify: root.update('notified', True)
+            if notify: send_job_done(root['id']) #send notification email
+    
+    @staticmethod
+    def children(md): #=> next steps of a pipeline step
+        return md.get('children') or ([md['nextstep']] if md.get('nextstep') else [])
+    
+    @staticmethod
+    def ready(jobid): #all previous steps of a waiting step have succeeded?
+        md = Metadata(jobid)
+        if job_queue.get(jobid) or not (md['waiting'] or md['status'] == Job.INIT): return False
+        return all([Metadata(parent)['status'] == Job.SUCCESS for parent in (md['depends'] or [])])
+    
+    @staticmethod
+    def cancel(jobid, msg): #mark a waiting step and its next steps as not run => cancelled?
+        md = Metadata(jobid)
+        if job_queue.get(jobid) or not (md['waiting'] or md['status'] == Job.INIT): return False
+        md['waiting'] = True #(can be resumed by restarting a previous step)
+        md.update("status", msg)
+        job_events.publish(jobid, dict(md.metadata))
+        for child in Job.children(md.metadata): Job.cancel(child, msg)
+        return True
     
     def check_outfiles(self):
         try: #remove empty stdout/stderr files
@@ -869,57 +2841,171 @@ class Job(object):
     
     def terminate(self, shutdown=False):
         with self.lock: #do this in one thread at a time
-            if self.popen is not None: self.popen.terminate()
+            if self.popen is not None or self.pgid: self.stop()
             self.status(Job.TERMINATED, end=True)
             if shutdown: self["status"] = self.errormsg[-16]
             self.update()
+        self.publish()
         logging.debug("Job "+self["id"]+" terminated.")
 
-#Class for creating job queues
+    def publish(self): #notify the status subscribers
+        job_events.publish(self["id"], dict(self.items))
+
+#durable record of the queued and running jobs (replayed after a server restart)
+#rows: job id in submission order => state ('queued'/'running'), process group, queue & start times
+class QueueJournal(object):
+    def __init__(self, catalog):
+        self.catalog = catalog #(shared sqlite db)
+        with catalog.lock:
+            catalog.db.execute('''CREATE TABLE IF NOT EXISTS queue (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE,
+                state TEXT, pgid INTEGER, queued REAL, started REAL)''')
+
+    def execute(self, sql, args=()):
+        with self.catalog.lock:
+            return self.catalog.db.execute(sql, args).fetchall()
+
+    def enqueued(self, jobid, queued): #(a requeued job keeps its place)
+        self.execute("INSERT OR IGNORE INTO queue (id, state, pgid, queued) VALUES (?, 'queued', 0, ?)", (jobid, queued))
+        self.execute("UPDATE queue SET state = 'queued', pgid = 0, started = NULL WHERE id = ?", (jobid,))
+
+    def started(self, jobid, pgid, started):
+        self.execute("UPDATE queue SET state = 'running', pgid = ?, started = ? WHERE id = ?", (pgid, started, jobid))
+
+    def requeue(self, jobid): #run again after restart
+        self.execute("UPDATE queue SET state = 'queued', pgid = 0, started = NULL WHERE id = ?", (jobid,))
+
+    def finished(self, jobid):
+        self.execute('DELETE FROM queue WHERE id = ?', (jobid,))
+
+    def entries(self): #=> [(jobid, state, pgid, queued, started), ...] in submission order
+        return [tuple(row) for row in self.execute('SELECT id, state, pgid, queued, started FROM queue ORDER BY seq')]
+
+#Class for creating job queues (jobs are scheduled against a CPU cores/memory budget,
+#in the order of priority class, owner fair share and expected running time)
 class Workqueue(object):
-    def __init__(self, numworkers=0, qtimeout=1, qsize=0):
-        self.jobs = {}
-        self.queue = queue.Queue(qsize)
-        self.workthreads = self._init_workers(numworkers)
-        self.qtimeout = qtimeout
+    PRIORITY = { 'low': 0, 'normal': 1, 'high': 2 }
+
+    #worker pool: from minworkers to numworkers threads (minworkers 0 = fixed size)
+    def __init__(self, numworkers=0, cores=0, memory=0, journal=None, minworkers=0):
+        self.jobs = {} #queued and running jobs
+        self.pending = [] #queued jobs (FIFO)
+        self.active = [] #running jobs
+        self.cond = threading.Condition()
+        self.maxworkers = numworkers or multiprocessing.cpu_count()
+        self.minworkers = min(minworkers, self.maxworkers) if minworkers > 0 else self.maxworkers
+        self.size = self.minworkers #max. nr. of jobs running in parallel (resized with the system load)
+        self.workthreads = [] #(started and stopped with the pool size)
+        self.resizes = deque(maxlen=20) #recent pool size changes
+        self.resizing = threading.Event() #wakes the pool size control thread
+        self.pressure = False #system load or memory use over the limit
+        self.cpusample = (0, {}) #(time, {pid: CPU seconds}) of the running job processes
+        self.cores = cores or self.maxworkers
+        self.memory = memory #MB (0 = not limited)
+        self.reservation = (None, 0) #(job waiting for resources, reservation start time)
+        self.usage = {} #owner => (decayed past usage in core-seconds, timestamp)
+        self.runtimes = {} #program => average running time (seconds)
+        self.journal = journal #QueueJournal (None = queue is not kept over restarts)
+        self.leases = {} #jobid => [agent, lease id, expiry time, job dir size] (jobs running on worker agents)
+        self.agents = {} #worker agent => last request time
+        self.ondone = None #callback(job) for finished jobs (agent mode: reports the results)
         self.running = False
     
-    def _init_workers(self, numworkers):
-        if numworkers == 0 :
-            numworkers = multiprocessing.cpu_count()
-        
-        tmp = []
-        #assign threads for running tasks
-        for tnum in range(numworkers):
+    def _spawn(self): #start threads up to the pool size (called with self.cond)
+        while len(self.workthreads) < self.size:
             t = threading.Thread(target=self._consume_queue)
             t.daemon = True
-            tmp.append(t)
-        return tmp
+            self.workthreads.append(t)
+            t.start()
     
     def start(self):
         self.running = True
-        for t in self.workthreads:
+        with self.cond:
+            self._spawn()
+        if self.minworkers < self.maxworkers:
+            t = threading.Thread(target=self._control)
+            t.daemon = True
             t.start()
-        logging.debug("Workqueue: started")
+        logging.debug("Workqueue: started (%s workers, %s cores, %s MB memory)" % (self.size if self.size == self.maxworkers else
+            '%d-%d' % (self.minworkers, self.maxworkers), self.cores, self.memory or 'unlimited'))
     
     def stop(self):
-        self.running = False
-        jobs = self.jobs.keys()
-        if(len(jobs)):
-            info("Warning: %s jobs in the queue were cancelled." % len(jobs))
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+            jobs = [j["id"] for j in self.active]
+            pending = [j["id"] for j in self.pending]
+        if self.journal: #queued jobs are kept, running jobs are restarted
+            if(len(jobs+pending)):
+                info("%s jobs in the queue will be resumed when the server is restarted." % len(jobs+pending))
+        else:
+            jobs += pending
+            if(len(jobs)):
+                info("Warning: %s jobs in the queue were cancelled." % len(jobs))
         for jobid in jobs:
             self.terminate(jobid, shutdown=True)
-        self.queue.join()
-        for t in self.workthreads:
+        for t in list(self.workthreads):
             t.join()
         logging.debug("Workqueue: stopped")
     
     def enqueue(self, jobid, job):
         logging.debug("Workqueue: enqueuing %s" % jobid)
-        self.jobs[jobid] = job
-        self.queue.put(job)
+        if job.cores > self.cores or (self.memory and job.memory > self.memory): #would never fit
+            logging.info("Workqueue: %s requests %s cores/%s MB (over the budget); limited to the budget" % (jobid, job.cores, job.memory))
+            job.cores = min(job.cores, self.cores)
+            if self.memory: job.memory = min(job.memory, self.memory)
+            job["resources"] = { "cores": job.cores, "memory": job.memory }
         job.status(Job.QUEUED)
         job.update()
+        if self.journal: Metadata(jobid).flush(sync=True) #(replayed after a crash)
+        with self.cond:
+            job.queued = time.time()
+            if self.journal: self.journal.enqueued(jobid, job.queued)
+            self.jobs[jobid] = job
+            self.pending.append(job)
+            self.cond.notify_all() #(a worker thread or a waiting agent lease)
+        self.resizing.set()
+        job.publish()
+    
+    def adopt(self, jobid, job, pgid): #add a job with running processes (from before a restart)
+        job.pgid = pgid
+        with self.cond:
+            self.jobs[jobid] = job
+            self.pending.insert(0, job) #(watched by the next free worker)
+            self.cond.notify()
+    
+    #put the jobs of the queue journal back in the queue (at server start)
+    def recover(self):
+        if not self.journal: return
+        started = time.time()
+        (requeued, adopted) = (0, 0)
+        for (jobid, state, pgid, queued, jobstart) in self.journal.entries():
+            try:
+                md = Metadata(jobid)
+                if state == 'running' and md['status'] not in (Job.INIT, Job.QUEUED, Job.RUNNING): #finished before the restart
+                    self.journal.finished(jobid)
+                    continue
+                if state == 'running' and self.alive(pgid, md.jobdir):
+                    job = Job(jobid, pgid)
+                    job.started = jobstart
+                    adopted += 1
+                else:
+                    if state == 'running': self.journal.requeue(jobid)
+                    job = Job(jobid)
+                    requeued += 1
+                job.queued = queued #(keeps the place in the queue)
+            except (IOError, OSError, AttributeError) as e:
+                logging.error("Workqueue: failed to resume job %s: %s" % (jobid, e))
+                self.journal.finished(jobid)
+        if requeued or adopted:
+            info("Workqueue: resumed %d queued jobs, re-adopted %d running jobs (%.1fs)" % (requeued, adopted, time.time()-started))
+    
+    @staticmethod
+    def alive(pgid, jobdir): #process group still running in the job dir?
+        if not pgid or not hasattr(os, 'killpg'): return False
+        try: os.killpg(pgid, 0)
+        except OSError: return False
+        try: return os.path.realpath(os.readlink('/proc/%d/cwd' % pgid)) == os.path.realpath(jobdir) #(reused pid?)
+        except OSError: return True #(group leader exited or no /proc)
     
     def get(self, jobid):
         try :
@@ -929,37 +3015,464 @@ class Workqueue(object):
             return None
     
     def terminate(self, jobid, shutdown=False):
-        if jobid in self.jobs: #queued job
-            self.get(jobid).terminate(shutdown) #remove from queue
-            del self.jobs[jobid]
-            self.queue.task_done() #mark as finished
+        job = self.get(jobid)
+        if job: #queued job
+            with self.cond:
+                if job in self.pending: self.pending.remove(job) #remove from queue
+                self.jobs.pop(jobid, None)
+                self.leases.pop(jobid, None) #(the agent stops the job on its next heartbeat)
+                self.cond.notify_all()
+            if self.journal:
+                job.resume = shutdown
+                if shutdown: self.journal.requeue(jobid)
+                else: self.journal.finished(jobid)
+            job.terminate(shutdown)
             logging.debug("Workqueue: terminated %s" % jobid)
-        else: #check the next pipeline step
-            md = Metadata(jobid)
-            if md['nextstep']:
-                self.terminate(md['nextstep'])
+        elif Job.cancel(jobid, Job.errormsg[-16 if shutdown else -15]): #waiting pipeline step
+            return #(cancel() marks the rest of the pipeline)
+        for child in Job.children(Metadata(jobid).metadata): #terminate the rest of the pipeline
+            self.terminate(child, shutdown)
+    
+    def busy(self): #=> running jobs (local and leased to worker agents)
+        return self.active + [self.jobs[jobid] for jobid in self.leases if jobid in self.jobs]
+    
+    def owner_usage(self, owner, now): #=> recent core-seconds used by the owner
+        (usage, stamp) = self.usage.get(owner, (0, now))
+        usage *= 0.5 ** ((now-stamp)/float(sharehalflife))
+        return usage + sum([j.cores*(now-j.started) for j in self.busy() if j.owner == owner])
+    
+    def ranked(self): #=> queued jobs in scheduling order
+        now = time.time()
+        running = {}
+        for j in self.busy(): running[j.owner] = running.get(j.owner, 0) + 1
+        usage = {}
+        for owner in set([j.owner for j in self.pending]): usage[owner] = self.owner_usage(owner, now)
+        def rank(job):
+            level = job.priority + int((now-job.queued)//queueaging) #aging: waiting jobs move up
+            short = self.runtimes.get(job["program"], shortjob+1) <= shortjob
+            return (-level, running.get(job.owner, 0), not short, usage[job.owner], job.queued)
+        return sorted(self.pending, key=rank)
+    
+    def position(self, jobid): #=> place of a job in the queue (0 = not queued)
+        with self.cond:
+            for i, job in enumerate(self.ranked()):
+                if job["id"] == jobid: return i+1
+        return 0
+    
+    def used(self): #=> (cores, memory) reserved by the running jobs
+        return (sum([j.cores for j in self.active]), sum([j.memory for j in self.active]))
+    
+    def capacity(self): #resource budget summary
+        with self.cond:
+            (cores, memory) = self.used()
+            head = self.reservation[0] if self.reservation[0] in self.pending else None
+            return {
+                "cores": self.cores, "memory": self.memory,
+                "used": { "cores": cores, "memory": memory },
+                "reserved": { "cores": head.cores if head else 0, "memory": head.memory if head else 0 },
+                "free": { "cores": self.cores-cores, "memory": self.memory-memory if self.memory else None },
+                "running": len(self.active), "queued": len(self.pending), "leased": len(self.leases),
+                "agents": len([a for a in self.agents.values() if time.time()-a < 2*leasetimeout]),
+                "workers": { "size": self.size, "min": self.minworkers, "max": self.maxworkers, "threads": len(self.workthreads),
+                    "resizes": list(self.resizes)[-5:] },
+                "waiting": max([time.time()-j.queued for j in self.pending] or [0]) #longest queue wait (seconds)
+            }
+    
+    #hand out queued jobs to a worker agent (in rank order, fitting the free resources of the agent)
+    #=> [(job, lease id)]; waits up to wait seconds for a job
+    def lease(self, agent, cores, memory=0, slots=1, wait=0):
+        deadline = time.time()+wait
+        memory = memory or None #(not limited)
+        leased = []
+        with self.cond:
+            self.agents[agent] = time.time()
+            while self.running:
+                self.expire_leases()
+                for job in self.ranked():
+                    if len(leased) >= slots: break
+                    if job.pgid or job.cores > cores or (memory is not None and job.memory > memory): continue
+                    cores -= job.cores
+                    if memory is not None: memory -= job.memory
+                    self.pending.remove(job)
+                    job.started = time.time()
+                    lease = uuid.uuid4().hex
+                    self.leases[job["id"]] = [agent, lease, job.started+leasetimeout, 0]
+                    leased.append((job, lease))
+                if leased or time.time() >= deadline: break
+                self.cond.wait(deadline-time.time())
+        for (job, lease) in leased:
+            self.leases[job["id"]][3] = getsize(job.jobdir, subdirs=False)
+            job.begin()
+            logging.debug("Workqueue: leased %s to agent %s" % (job["id"], agent))
+        return leased
+    
+    def heartbeat(self, jobid, lease, agent): #extend a lease => False if not leased (expired or terminated)
+        with self.cond:
+            self.agents[agent] = time.time()
+            entry = self.leases.get(jobid)
+            if not entry or entry[1] != lease: return False
+            entry[2] = time.time()+leasetimeout
+            return True
+    
+    def complete(self, jobid, lease, rc, usage): #job finished by a worker agent => False if not leased
+        with self.cond:
+            entry = self.leases.get(jobid)
+            job = self.jobs.get(jobid)
+            if not entry or entry[1] != lease or not job: return False
+            entry[1:3] = [None, float('inf')] #(completing)
+        usage["queuewait"] = round(job.started-job.queued, 3)
+        usage["agent"] = entry[0]
+        job["usage"] = usage
+        job["size"] = getsize(job.jobdir, subdirs=False)
+        usage["outsize"] = job["size"] - entry[3]
+        job.end(rc)
+        disk_usage.add(job["size"] - entry[3]) #register output files
+        self._finished(job)
+        logging.debug("Workqueue: agent %s completed %s (status: %s)" % (entry[0], jobid, job.status()))
+        return True
+    
+    def expire_leases(self): #requeue the jobs of unresponsive worker agents (called with self.cond)
+        now = time.time()
+        for (jobid, entry) in list(self.leases.items()):
+            if entry[2] > now: continue
+            del self.leases[jobid]
+            job = self.jobs.get(jobid)
+            if not job: continue
+            logging.info("Workqueue: lease of %s by agent %s expired; requeued" % (jobid, entry[0]))
+            job.status(Job.QUEUED)
+            job.update()
+            self.pending.append(job)
+            if self.journal: self.journal.requeue(jobid)
+            self.cond.notify_all()
+    
+    #pick the next job that fits in the free resources (in rank order; smaller jobs are backfilled
+    #around a waiting job until its reservation times out)
+    def _next(self):
+        self.expire_leases()
+        for job in self.pending: #re-adopted jobs are already running
+            if job.pgid:
+                self.pending.remove(job)
+                return job
+        if len(self.active) >= self.size or not self.pending: return None
+        (cores, memory) = self.used()
+        for i, job in enumerate(self.ranked()):
+            if job.cores <= self.cores-cores and (not self.memory or job.memory <= self.memory-memory):
+                if self.reservation[0] is job: self.reservation = (None, 0)
+                elif i: logging.debug("Workqueue: backfilling %s" % job["id"])
+                self.pending.remove(job)
+                return job
+            if i == 0: #first job waits for resources
+                if self.reservation[0] is not job:
+                    self.reservation = (job, time.time())
+                    logging.debug("Workqueue: reserving %s cores/%s MB for %s" % (job.cores, job.memory, job["id"]))
+                if time.time()-self.reservation[1] > reservetimeout: return None #let the running jobs drain
+        return None
     
     #consume tasks from queue in parallel threads
     def _consume_queue(self):
         while self.running:
-            try : #remove a job object from queue
-                job = self.queue.get(timeout=self.qtimeout)
-            except queue.Empty:
-                continue
+            with self.cond:
+                job = self._next()
+                if not job:
+                    if len(self.workthreads) > self.size: #(pool shrunk)
+                        self.workthreads.remove(threading.current_thread())
+                        return
+                    leases = [entry[2] for entry in self.leases.values() if entry[1]] #(not completing: no expiry)
+                    self.cond.wait(max(min(leases)-time.time(), 0.1) if leases else None) #(idle until notified)
+                    continue
+                if not job.pgid: job.started = time.time()
+                self.active.append(job)
             
             jobid = job["id"]
             logging.debug("Workqueue: starting %s" % jobid)
             
             try: #run the job (wait until finishes)
                 job.process()
-            except OSError:
-                raise
-            
-            if jobid in self.jobs:
-                del self.jobs[jobid]
-                self.queue.task_done() #mark the (most recently removed) task as done
-                logging.debug("Workqueue: completed %s (status: %s)" % (jobid, job.status()))
+            except Exception as e: #(keep the worker thread in the pool)
+                logging.exception("Workqueue: %s failed: %s" % (jobid, e))
+            finally:
+                self._finished(job)
+            logging.debug("Workqueue: completed %s (status: %s)" % (jobid, job.status()))
+            if self.ondone:
+                try: self.ondone(job)
+                except Exception as e: logging.exception("Workqueue: failed to report %s: %s" % (jobid, e))
+    
+    def load(self): #=> (1-min load average, free memory share, CPU use of the running jobs per reserved core) (None = unknown)
+        try: load = os.getloadavg()[0]
+        except (AttributeError, OSError): load = 0.0
+        memfree = None
+        try:
+            with open('/proc/meminfo') as f:
+                meminfo = dict([(line.split(':')[0], line.split()[1]) for line in f if ':' in line])
+            memfree = float(meminfo['MemAvailable'])/float(meminfo['MemTotal'])
+        except (IOError, OSError, KeyError, ValueError, IndexError):
+            try: memfree = float(os.sysconf('SC_AVPHYS_PAGES'))/os.sysconf('SC_PHYS_PAGES')
+            except (AttributeError, ValueError, OSError): pass
+        with self.cond:
+            jobs = dict([(j.pgid, (j.started, j.cores)) for j in self.active if j.pgid])
+        (then, prev) = self.cpusample
+        now = time.time()
+        jobs = dict([(g, (now-max(then, t))*c) for (g, (t, c)) in jobs.items() if now-max(then, t) >= 0.5]) #reserved CPU time
+        (cpu, used) = ({}, 0.0)
+        try: pids = [int(d) for d in os.listdir('/proc') if d.isdigit()] if jobs else []
+        except OSError: pids = []
+        for pid in pids: #CPU time of the job process groups since the last sample (or the job start)
+            try:
+                with open('/proc/%d/stat' % pid) as f: fields = f.read().rsplit(')', 1)[1].split()
+                if int(fields[2]) not in jobs: continue
+                cpu[pid] = sum([int(t) for t in fields[11:15]])/float(os.sysconf('SC_CLK_TCK')) #(utime+stime+cutime+cstime)
+                used += cpu[pid]-prev.get(pid, 0)
+            except (IOError, OSError, ValueError, IndexError): pass
+        self.cpusample = (now, cpu)
+        return (load, memfree, used/sum(jobs.values()) if cpu else None)
+    
+    def resize(self): #adapt the pool size to the queue, the system load and free memory
+        (load, memfree, jobcpu) = self.load()
+        ncpu = multiprocessing.cpu_count()
+        with self.cond:
+            (size, active, queued) = (self.size, len(self.active), len(self.pending))
+            target = size
+            self.pressure = True
+            if memfree is not None and memfree < memlow: (target, reason) = (max(self.minworkers, size-1), 'low memory')
+            elif load > loadhigh*ncpu: (target, reason) = (max(self.minworkers, size-1), 'high load')
+            else:
+                self.pressure = False
+                if queued and active >= size: #jobs wait for a worker: add as many as the load allows
+                    perjob = max(jobcpu, 0.25) if jobcpu is not None else 1.0 #(expected load of a new job)
+                    extra = int((loadhigh*ncpu-load)/perjob)
+                    (target, reason) = (min(self.maxworkers, size+extra, active+queued), 'queued jobs')
+                elif not queued: (target, reason) = (max(self.minworkers, active, size-1), 'idle workers')
+            if target == size: return
+            self.size = target
+            self._spawn()
+            self.cond.notify_all() #(extra idle threads exit)
+        event = { "time": int(time.time()), "from": size, "to": target, "reason": reason, "queued": queued, "load": round(load, 2),
+            "memfree": round(memfree, 2) if memfree is not None else None, "jobcpu": round(jobcpu, 2) if jobcpu is not None else None }
+        self.resizes.append(event)
+        metrics.inc('pline_worker_resizes_total', (('direction', 'up' if target > size else 'down'),))
+        logging.info("Workqueue: %d => %d workers (%s; %d queued, load %.2f, free memory %s, job CPU use %s)" % (size, target, reason, queued,
+            load, '%d%%' % (memfree*100) if memfree is not None else '?', '%d%%' % (jobcpu*100) if jobcpu is not None else '?'))
+    
+    def _control(self): #resize the worker pool (when jobs are queued and every resizeinterval seconds)
+        while self.running:
+            self.resizing.wait(resizeinterval)
+            self.resizing.clear()
+            if not self.running: break
+            try: self.resize()
+            except Exception as e: logging.exception("Workqueue: worker pool resize failed: %s" % e)
+            time.sleep(1) #(max. one resize per second)
+    
+    def _finished(self, job): #bookkeeping of an ended job (local or leased)
+        labels = (('plugin', job["plugin"]), ('status', str(job.status())))
+        metrics.inc('pline_jobs_finished_total', labels)
+        metrics.observe('pline_job_duration_seconds', time.time()-job.started, labels, Metrics.JOB_BUCKETS)
+        metrics.observe('pline_job_queue_wait_seconds', job.started-job.queued, (), Metrics.JOB_BUCKETS)
+        with self.cond:
+            now = time.time()
+            (usage, stamp) = self.usage.get(job.owner, (0, now)) #decayed past usage + this job (other running jobs are added when they end)
+            self.usage[job.owner] = (usage * 0.5 ** ((now-stamp)/float(sharehalflife)) + job.cores*(now-job.started), now)
+            if len(self.usage) > 1000: #forget inactive owners
+                for owner in list(self.usage.keys()):
+                    if self.owner_usage(owner, now) < 1: del self.usage[owner]
+            runtime = now-job.started
+            avg = self.runtimes.get(job["program"])
+            self.runtimes[job["program"]] = runtime if avg is None else 0.7*avg + 0.3*runtime
+            if job in self.active: self.active.remove(job)
+            self.leases.pop(job["id"], None)
+            self.jobs.pop(job["id"], None)
+            self.cond.notify_all() #resources released
+        if self.journal and not job.resume: self.journal.finished(job["id"])
+
+
+#worker agent: runs jobs leased from a main Pline server in a local workqueue
+#(input files are downloaded to the agent data dir; logs are sent with the heartbeats, output files when the job ends)
+class WorkerAgent(object):
+    def __init__(self, url, name, key=''):
+        url = urlsplit(url if '://' in url else 'http://'+url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.path = url.path.rstrip('/') + '/'
+        self.name = name
+        self.key = key
+        self.leases = {} #jobid => {lease: lease id, stdout/logfile: sent bytes, inputs: staged job dir files, lost: bool}
+        self.lock = threading.Lock()
+        self.slotfree = threading.Event()
+        self.running = False
 
+    #POST a multipart form (data: {name: bytes} and files: [(name, filepath)] are sent as file fields) => parsed JSON response
+    def request(self, fields, files=(), data={}, timeout=60):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for (key, val) in fields.items():
+            parts.append(('Content-Disposition: form-data; name="%s"\r\n' % key, str(val).encode('utf-8'), None))
+        for (key, val) in data.items():
+            parts.append(('Content-Disposition: form-data; name="%s"; filename="data"\r\n' % key, val, None))
+        for (key, fpath) in files:
+            parts.append(('Content-Disposition: form-data; name="%s"; filename="data"\r\n' % key, None, fpath))
+        heads = [('--%s\r\n%s\r\n' % (boundary, head)).encode('utf-8') for (head, val, fpath) in parts]
+        end = ('--%s--\r\n' % boundary).encode('utf-8')
+        length = sum([len(h)+2 for h in heads]) + len(end)
+        length += sum([len(val) if fpath is None else os.path.getsize(fpath) for (head, val, fpath) in parts])
+        conn = HTTPConnection(self.host, self.port, timeout=timeout)
+        try:
+            conn.putrequest('POST', '%s?action=%s' % (self.path, fields.get('action', ''))) #(the asyncio front end routes long polls by the query)
+            conn.putheader('Content-Type', 'multipart/form-data; boundary='+boundary)
+            conn.putheader('Content-Length', str(length))
+            conn.endheaders()
+            for (h, (head, val, fpath)) in zip(heads, parts):
+                conn.send(h)
+                if fpath is None: conn.send(val)
+                else: #stream the file
+                    with open(fpath, 'rb') as f:
+                        for chunk in iter(lambda: f.read(blocksize), b''): conn.send(chunk)
+                conn.send(b'\r\n')
+            conn.send(end)
+            resp = conn.getresponse()
+            body = resp.read()
+            if resp.status != 200: raise IOError('%s request failed (%s): %s' % (fields.get('action'), resp.status, body[:200]))
+            return json.loads(body.decode('utf-8'))
+        finally:
+            conn.close()
+
+    def download(self, src, fpath): #copy a file from the main server data dir
+        conn = HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request('GET', self.path+'?data='+quote(src))
+            resp = conn.getresponse()
+            if resp.status != 200: raise IOError('Failed to download %s (%s)' % (src, resp.status))
+            with open(fpath, 'wb') as f:
+                for chunk in iter(lambda: resp.read(blocksize), b''): f.write(chunk)
+        finally:
+            conn.close()
+
+    def free(self): #=> (job slots, cores, memory) not used by the local jobs
+        with job_queue.cond:
+            jobs = list(job_queue.jobs.values())
+        memory = job_queue.memory - sum([j.memory for j in jobs]) if job_queue.memory else 0
+        if job_queue.memory and memory <= 0: return (0, 0, 0)
+        slots = job_queue.size if job_queue.pressure else job_queue.maxworkers #(the pool grows for leased jobs)
+        return (slots-len(jobs), job_queue.cores-sum([j.cores for j in jobs]), memory)
+
+    def run(self):
+        self.running = True
+        t = threading.Thread(target=self._heartbeat_loop)
+        t.daemon = True
+        t.start()
+        info("Worker agent %s: running jobs from http://%s:%d%s" % (self.name, self.host, self.port, self.path))
+        while self.running:
+            (slots, cores, memory) = self.free()
+            if slots <= 0 or cores <= 0:
+                self.slotfree.wait(agentbeat)
+                self.slotfree.clear()
+                continue
+            try: jobs = self.request({ "action": "lease", "agent": self.name, "key": self.key,
+                "slots": slots, "cores": cores, "memory": memory, "wait": 20 }, timeout=60)["jobs"]
+            except (IOError, OSError, ValueError, KeyError, socket.error) as e:
+                logging.error("Worker agent: lease request failed: %s" % e)
+                time.sleep(agentbeat)
+                continue
+            for spec in jobs: self.start(spec)
+
+    def start(self, spec): #stage the input files and queue a leased job
+        jobid = spec["id"]
+        jobdir = joinp(datadir, jobid)
+        if os.path.isdir(jobdir): shutil.rmtree(jobdir)
+        os.makedirs(jobdir, 0o775)
+        with self.lock:
+            self.leases[jobid] = { "lease": spec["lease"], "stdout": 0, "logfile": 0, "inputs": {}, "started": False, "lost": False }
+        try:
+            for name in spec["files"]:
+                fpath = joinp(jobdir, name) #(inputs from the previous pipeline steps: ../filename)
+                if not os.path.isdir(os.path.dirname(fpath)): os.makedirs(os.path.dirname(fpath), 0o775)
+                self.download(os.path.normpath(os.path.join(jobid, name)).replace(os.sep, '/'), fpath)
+            md = Metadata.create(jobid, name=spec["name"])
+            for attr in ('id', 'plugin', 'program', 'parameters', 'infiles', 'outfiles', 'stdout', 'logfile'):
+                if spec.get(attr): md[attr] = spec[attr]
+            md.flush(sync=True)
+            self.leases[jobid].update({ "inputs": ResultCache.files(jobdir), "started": True })
+            logging.debug("Worker agent: starting %s (%d input files)" % (jobid, len(spec["files"])))
+            Job(jobid)
+        except (IOError, OSError, ValueError, socket.error) as e: #report as failed
+            logging.error("Worker agent: failed to start %s: %s" % (jobid, e))
+            write_file(os.path.join(jobdir, spec["logfile"] or "err.log"), ("Worker agent %s: %s" % (self.name, e)).encode('utf-8'))
+            self.report(jobid, jobdir, -1, {})
+
+    def done(self, job): #(workqueue callback) send the results of a finished job
+        self.slotfree.set()
+        self.report(job["id"], job.jobdir, job.status(), job["usage"] or {})
+
+    def report(self, jobid, jobdir, rc, usage):
+        with self.lock:
+            lease = self.leases.pop(jobid, None)
+        if lease and not lease["lost"] and self.running:
+            files = [name for (name, st) in ResultCache.files(jobdir).items() if lease["inputs"].get(name) != st]
+            fields = { "action": "complete", "agent": self.name, "key": self.key, "jobid": jobid, "lease": lease["lease"],
+                "status": rc, "usage": json.dumps(usage), "files": json.dumps([f.replace(os.sep, '/') for f in files]) }
+            for attempt in range(5):
+                try:
+                    if not self.request(fields, [('file:'+f.replace(os.sep, '/'), os.path.join(jobdir, f)) for f in files], timeout=600)["ok"]:
+                        logging.info("Worker agent: lease of %s expired; results discarded" % jobid)
+                    break
+                except (IOError, OSError, ValueError, KeyError, socket.error) as e:
+                    logging.error("Worker agent: failed to send the results of %s: %s" % (jobid, e))
+                    time.sleep(agentbeat*(attempt+1))
+        metadata_store.forget(jobdir)
+        root = jobid.split('/')[0]
+        with self.lock: #remove the local files (when no other step of the pipeline runs here)
+            if any([j == root or j.startswith(root+'/') for j in self.leases]): root = jobid
+        shutil.rmtree(joinp(datadir, root), ignore_errors=True)
+
+    def _heartbeat_loop(self): #extend the leases and send the new log output
+        while self.running:
+            time.sleep(agentbeat)
+            with self.lock:
+                leases = [(jobid, lease) for (jobid, lease) in self.leases.items() if lease["started"]]
+            for (jobid, lease) in leases:
+                md = Metadata(jobid).metadata if os.path.isdir(joinp(datadir, jobid)) else {}
+                fields = { "action": "heartbeat", "agent": self.name, "key": self.key, "jobid": jobid, "lease": lease["lease"] }
+                (logs, sent) = ({}, {})
+                for key in ('stdout', 'logfile'):
+                    fname = md.get(key)
+                    if not fname: continue
+                    try:
+                        with open(joinp(datadir, jobid, fname), 'rb') as f:
+                            f.seek(lease[key])
+                            data = f.read(loglimit)
+                    except (IOError, OSError): continue
+                    if data:
+                        (logs[key], fields[key+'pos']) = (data, lease[key])
+                        sent[key] = lease[key]+len(data)
+                try: ok = self.request(fields, data=logs, timeout=30)["ok"]
+                except (IOError, OSError, ValueError, KeyError, socket.error) as e:
+                    logging.error("Worker agent: heartbeat failed: %s" % e)
+                    continue
+                if ok: lease.update(sent)
+                elif not lease["lost"]: #expired or terminated on the server
+                    logging.info("Worker agent: lease of %s lost; stopping the job" % jobid)
+                    lease["lost"] = True
+                    job_queue.terminate(jobid)
+
+#run as a worker agent of a main Pline server
+def run_agent(url):
+    global datadir
+    global disk_usage
+    global job_queue
+    name = '%s-%d' % (socket.gethostname(), os.getpid())
+    datadir = os.path.join(datadir, '.agents', name) #local job dirs
+    if not os.path.isdir(datadir): os.makedirs(datadir, 0o775)
+    disk_usage = DiskUsage(datadir)
+    job_queue = Workqueue(maxworkers, cores=maxcores, memory=maxmemory or system_memory(), minworkers=minworkers)
+    agent = WorkerAgent(url, name, agentkey)
+    job_queue.ondone = agent.done
+    plugin_registry.refresh(force=True)
+    job_queue.start()
+    try: agent.run()
+    except KeyboardInterrupt:
+        info("Stopping worker agent...")
+    agent.running = False #(leases of unfinished jobs expire on the main server: the jobs are requeued)
+    job_queue.stop()
+    shutil.rmtree(datadir, ignore_errors=True)
+    return 0
 
 #HTTP server subclass for multithreading
 class MultiThreadServer(ThreadingMixIn, HTTPServer):
@@ -983,7 +3496,13 @@ def main():
     global logtofile
     global local
     global job_queue
+    global zip_cache
+    global result_cache
+    global blob_store
+    global disk_usage
+    global job_catalog
     global openbrowser
+    global asyncserver
     
     parser = argparse.ArgumentParser(description="Backend server for Pline webapp.")
     parser.add_argument("-p", "--port", type=int, metavar="N", help="set the server port (default: %s)" % serverport, default=serverport)
@@ -996,22 +3515,48 @@ def main():
     lgroup = parser.add_mutually_exclusive_group()
     lgroup.add_argument("-l", "--local", action='store_true', help="start as local server %s" % ("(default)" if local else ""), default=local)
     lgroup.add_argument("-r", "--remote", action='store_true', help="start as web server %s" % ("(default)" if not local else ""))
-    parser.add_argument("-o", "--open", action='store_true', help="open web browser %s" % ("(default)" if local and openbrowser else ""), default=openbrowser)
+    bgroup = parser.add_mutually_exclusive_group()
+    bgroup.add_argument("-o", "--open", action='store_true', help="open web browser %s" % ("(default)" if local and openbrowser else ""), default=openbrowser)
+    bgroup.add_argument("-n", "--no-open", dest='open', action='store_false', help="do not open a web browser")
+    parser.add_argument("-a", "--async", dest='asyncserver', action='store_true', help="serve requests from an asyncio event loop %s" % ("(default)" if asyncserver else ""), default=asyncserver)
+    parser.add_argument("--rebuild-catalog", action='store_true', help="recreate the job catalog from the data dir and exit")
+    parser.add_argument("--agent", metavar="URL", help="run as a worker agent of the Pline server at URL (e.g. http://host:8000)")
     args = parser.parse_args()
     if args.port: serverport = args.port
     debug = False if args.quiet else args.verbose
     logtofile = False if args.console else args.filelog
     local = False if args.remote else args.local
-    if args.open: openbrowser = args.open
+    openbrowser = args.open
+    asyncserver = args.asyncserver
     start_logging()
+    if args.agent: return run_agent(args.agent)
     
+    job_catalog = JobCatalog(os.path.join(datadir, '.jobs.db'))
+    metadata_store.onsave = job_catalog.upsert
+    if args.rebuild_catalog:
+        job_catalog.rebuild()
+        return 0
     info('Starting server...\n')
-    job_queue = Workqueue(num_workers)
+    if dedupinputs: blob_store = BlobStore(os.path.join(datadir, '.blobs'), job_catalog)
+    disk_usage = DiskUsage(datadir)
+    disk_usage.start()
+    job_queue = Workqueue(maxworkers, cores=maxcores, memory=maxmemory or system_memory(), journal=QueueJournal(job_catalog), minworkers=minworkers)
+    zip_cache = ZipCache(os.path.join(tempdir, 'zipcache'), zipcache)
+    if resultcache: result_cache = ResultCache(os.path.join(datadir, '.cache'), resultcache*(10**6), job_catalog)
+    plugin_registry.refresh(force=True)
+    job_queue.recover() #jobs queued before the restart
     job_queue.start()
+    janitor.start() #(after the recovery: active job dirs are kept)
     
     try:
-        server = MultiThreadServer(('',serverport), plineServer)
-        info("Pline HTTP server started at port %d\n" % serverport)
+        if asyncserver and sys.version_info < (3, 7):
+            logging.error("The asyncio front end requires Python 3.7+. Using threaded server.")
+            asyncserver = False
+        if asyncserver:
+            from pline_aio import AsyncServer
+            server = AsyncServer(('',serverport), plineServer, httpthreads)
+        else: server = MultiThreadServer(('',serverport), plineServer)
+        info("Pline HTTP server started at port %d%s\n" % (serverport, " (asyncio)" if asyncserver else ""))
         info("Press CRTL+C to stop the server.\n")
         logging.debug('Serving from: %s' % plinedir)
         logging.debug('Hostname: %s' % socket.getfqdn()) #get server hostname
@@ -1025,11 +3570,12 @@ def main():
         return -1
     except KeyboardInterrupt:
         info("Shutting down server...")
-        server.socket.close()
+        server.server_close()
     except Exception as e:
         logging.exception("Server runtime error: %s" % e)
 
     job_queue.stop()
+    metadata_store.flush()
     return 0
 
 if __name__ == '__main__': #when run as script
@@ -0,0 +1,227 @@
+#unit tests of pline_server.py helpers (run with: python -m pytest tests)
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pline_server as ps
+
+#request handler with just the request headers (get_ranges() only reads self.headers)
+class handler(ps.plineServer):
+    def __init__(self, headers):
+        self.headers = headers
+
+#POST request body => Form
+def multipart(fields, boundary='XyZ', **kw):
+    body = b''
+    for (name, filename, data) in fields:
+        disp = 'form-data; name="%s"' % name + ('; filename="%s"' % filename if filename else '')
+        body += b'--' + boundary.encode() + b'\r\nContent-Disposition: ' + disp.encode() + b'\r\n\r\n' + data + b'\r\n'
+    body += b'--' + boundary.encode() + b'--\r\n'
+    headers = { 'Content-Type': 'multipart/form-data; boundary=' + boundary, 'Content-Length': str(len(body)) }
+    return ps.Form(io.BytesIO(body), headers, **kw)
+
+#temporary data and plugin dirs (module globals are normally set up by main())
+class TempDataDir(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (ps.datadir, ps.plugindir, ps.plugin_registry, ps.job_queue)
+        ps.datadir = os.path.join(self.tmp, 'analyses')
+        ps.plugindir = os.path.join(self.tmp, 'plugins')
+        os.makedirs(os.path.join(ps.plugindir, 'sh'))
+        with open(os.path.join(ps.plugindir, 'sh', 'plugin.json'), 'w') as f: json.dump({ "name": "sh", "program": "sh" }, f)
+        ps.plugin_registry = ps.PluginRegistry(ps.plugindir)
+        self.catalog = ps.JobCatalog(os.path.join(self.tmp, 'jobs.db'))
+
+    def tearDown(self):
+        (ps.datadir, ps.plugindir, ps.plugin_registry, ps.job_queue) = self.saved
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def addjob(self, jobid, **md): #write a job dir with its job.json
+        data = { "id": jobid, "name": jobid, "plugin": "sh/plugin.json", "program": "sh", "parameters": "-c true", "status": ps.Job.INIT }
+        data.update(md)
+        os.makedirs(os.path.join(ps.datadir, jobid))
+        with open(os.path.join(ps.datadir, jobid, ps.Metadata.FILE), 'w') as f: json.dump(data, f)
+
+
+class GetRangesTest(unittest.TestCase):
+    def ranges(self, hrange, size=1000, **headers):
+        headers['Range'] = hrange
+        return handler(headers).get_ranges(size, etag='"abc"', mtime=1000000000)
+
+    def test_no_range(self):
+        self.assertEqual(handler({}).get_ranges(1000), None)
+        self.assertEqual(self.ranges('items=0-10'), None)
+
+    def test_single_ranges(self):
+        self.assertEqual(self.ranges('bytes=0-99'), [(0, 99)])
+        self.assertEqual(self.ranges('bytes=900-'), [(900, 999)])
+        self.assertEqual(self.ranges('bytes=-100'), [(900, 999)])
+        self.assertEqual(self.ranges('bytes=-5000'), [(0, 999)])
+        self.assertEqual(self.ranges('bytes=990-5000'), [(990, 999)])
+
+    def test_unsatisfiable(self):
+        self.assertEqual(self.ranges('bytes=1000-'), [])
+        self.assertEqual(self.ranges('bytes=-0'), [])
+
+    def test_invalid_header_is_ignored(self):
+        self.assertEqual(self.ranges('bytes=10-5'), None)
+        self.assertEqual(self.ranges('bytes=a-b'), None)
+        self.assertEqual(self.ranges('bytes=10'), None)
+
+    def test_overlapping_ranges_are_merged(self):
+        self.assertEqual(self.ranges('bytes=50-60, 0-10,5-20,21-30'), [(0, 30), (50, 60)])
+
+    def test_if_range(self):
+        self.assertEqual(self.ranges('bytes=0-9', **{ 'If-Range': '"abc"' }), [(0, 9)])
+        self.assertEqual(self.ranges('bytes=0-9', **{ 'If-Range': '"old"' }), None)
+        self.assertEqual(self.ranges('bytes=0-9', **{ 'If-Range': 'Sat, 01 Jan 2000 00:00:00 GMT' }), None) #file changed since
+        self.assertEqual(self.ranges('bytes=0-9', **{ 'If-Range': 'Fri, 01 Jan 2100 00:00:00 GMT' }), [(0, 9)])
+
+
+class FormTest(unittest.TestCase):
+    def test_multipart_fields(self):
+        form = multipart([('action', '', b'run'), ('file:in.txt', 'in.txt', b'abc\r\n--Xy\r\n')])
+        try:
+            self.assertEqual(sorted(form.keys()), ['action', 'file:in.txt'])
+            self.assertEqual(form.getvalue('action'), 'run')
+            self.assertEqual(form.getvalue('file:in.txt'), b'abc\r\n--Xy\r\n') #(partial delimiter)
+            self.assertEqual(form.getvalue('missing', 'x'), 'x')
+            self.assertTrue('action' in form)
+        finally: form.close()
+
+    def test_spooled_text_field(self): #large text fields are read back as text
+        data = b'\xc3\xa4' * (ps.FormPart.MAXMEM//2+1)
+        form = multipart([('pipeline', '', data)])
+        try:
+            self.assertTrue(form.parts['pipeline'].path)
+            self.assertTrue(form.getvalue('pipeline') == (data if bytes is str else data.decode('utf-8'))) #(native string)
+        finally: form.close()
+        self.assertFalse(os.path.exists(form.parts['pipeline'].path))
+
+    def test_urlencoded(self):
+        body = b'action=run&name=a%20b&empty='
+        form = ps.Form(io.BytesIO(body), { 'Content-Type': 'application/x-www-form-urlencoded', 'Content-Length': str(len(body)) })
+        self.assertEqual((form.getvalue('action'), form.getvalue('name'), form.getvalue('empty')), ('run', 'a b', ''))
+
+    def test_limits(self):
+        self.assertRaises(ps.SizeLimitError, multipart, [('a', '', b'x'*100)], maxsize=50)
+        self.assertRaises(ps.SizeLimitError, multipart, [('a', '', b'x'*100)], maxpart=50)
+        self.assertRaises(AttributeError, ps.Form, io.BytesIO(b''), { 'Content-Type': 'multipart/form-data', 'Content-Length': '0' })
+        self.assertRaises(AttributeError, ps.Form, io.BytesIO(b''), { 'Content-Length': 'x' })
+
+    def test_incomplete_request(self):
+        body = b'--XyZ\r\nContent-Disposition: form-data; name="a"\r\n\r\nabc'
+        headers = { 'Content-Type': 'multipart/form-data; boundary=XyZ', 'Content-Length': str(len(body)+100) }
+        self.assertRaises(IOError, ps.Form, io.BytesIO(body), headers)
+
+
+class JobCatalogTest(TempDataDir):
+    def test_upsert_and_query(self):
+        self.addjob('a', status=0, created=100, email='x@example.com', keepData=True)
+        self.addjob('a/b', status=-1, created=101)
+        for jobid in ('a', 'a/b'):
+            fpath = os.path.join(ps.datadir, jobid, ps.Metadata.FILE)
+            with open(fpath) as f: self.catalog.upsert(fpath, json.load(f))
+        self.assertEqual(self.catalog.get('a/b')['root'], 'a')
+        self.assertEqual(self.catalog.get('a')['keepData'], 1)
+        self.assertEqual([j['id'] for j in self.catalog.query()], ['a/b', 'a'])
+        self.assertEqual([j['id'] for j in self.catalog.query(status=0)], ['a'])
+        self.assertEqual([j['id'] for j in self.catalog.query(email='x@example.com')], ['a'])
+        self.assertEqual(self.catalog.roots(), []) #(keepData)
+        self.catalog.remove('a')
+        self.assertEqual(self.catalog.query(), [])
+
+    def test_rebuild(self):
+        self.addjob('a', created=100)
+        self.addjob('a/b', created=101)
+        self.addjob('c', created=102)
+        self.addjob('.cache', created=103) #(hidden dirs are skipped)
+        with open(os.path.join(ps.datadir, 'c', ps.Metadata.FILE), 'w') as f: f.write('{broken')
+        self.catalog.rebuild(ps.datadir)
+        self.assertEqual(sorted([j['id'] for j in self.catalog.query()]), ['a', 'a/b'])
+        self.assertEqual([r[0] for r in self.catalog.roots()], ['a'])
+
+    def test_failed_rebuild_keeps_catalog(self):
+        self.addjob('a', created=100)
+        self.catalog.rebuild(ps.datadir)
+        self.addjob('b', created=101)
+        upsert = self.catalog._upsert
+        def failing(fpath, md, mtime):
+            if md['id'] == 'b': raise ValueError('test')
+            upsert(fpath, md, mtime)
+        self.catalog._upsert = failing
+        self.assertRaises(ValueError, self.catalog.rebuild, ps.datadir)
+        self.assertEqual([j['id'] for j in self.catalog.query()], ['a'])
+
+
+class QueueJournalTest(TempDataDir):
+    def test_recover(self):
+        journal = ps.QueueJournal(self.catalog)
+        ps.job_queue = ps.Workqueue(numworkers=1, journal=journal)
+        self.addjob('queued', status=ps.Job.QUEUED)
+        self.addjob('running', status=ps.Job.RUNNING)
+        self.addjob('finished', status=ps.Job.SUCCESS)
+        for (i, jobid) in enumerate(('queued', 'running', 'finished', 'removed')):
+            journal.enqueued(jobid, 1000+i)
+            if jobid != 'queued': journal.started(jobid, 0, 2000+i) #(no process group: not alive)
+        ps.job_queue.recover()
+        self.assertEqual([j["id"] for j in ps.job_queue.pending], ['queued', 'running'])
+        self.assertEqual([j.queued for j in ps.job_queue.pending], [1000, 1001]) #(places in the queue are kept)
+        self.assertEqual([e[:3] for e in journal.entries()], [('queued', 'queued', 0), ('running', 'queued', 0)])
+        journal.finished('queued')
+        self.assertEqual([e[0] for e in journal.entries()], ['running'])
+
+
+#queued job with the attributes used by the scheduler
+class FakeJob(object):
+    def __init__(self, jobid, cores=1, memory=0, queued=0, pgid=0):
+        self.items = { "id": jobid, "program": jobid }
+        self.cores = cores
+        self.memory = memory
+        self.queued = queued or time.time()
+        self.started = 0
+        self.pgid = pgid
+        self.owner = 'local'
+        self.priority = 1
+
+    def __getitem__(self, key):
+        return self.items.get(key, "")
+
+class WorkqueueNextTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = ps.Workqueue(numworkers=4, cores=4)
+        self.queue.active = [FakeJob('running', cores=2)]
+        self.queue.active[0].started = time.time()
+
+    def test_backfill(self):
+        big = FakeJob('big', cores=4, queued=1)
+        small = FakeJob('small', cores=2, queued=2)
+        self.queue.pending = [big, small]
+        self.assertTrue(self.queue._next() is small) #(big waits for the running job)
+        self.assertTrue(self.queue.reservation[0] is big)
+        self.queue.pending.append(FakeJob('later', cores=1, queued=3))
+        self.queue.reservation = (big, time.time()-ps.reservetimeout-1)
+        self.assertEqual(self.queue._next(), None) #reservation timed out: no more backfilling
+        self.queue.active = []
+        self.assertTrue(self.queue._next() is big)
+        self.assertEqual(self.queue.reservation, (None, 0))
+
+    def test_adopted_jobs_first(self):
+        adopted = FakeJob('adopted', cores=4, pgid=12345)
+        self.queue.pending = [FakeJob('queued'), adopted]
+        self.assertTrue(self.queue._next() is adopted) #(already running: not limited by the budget)
+
+    def test_pool_size(self):
+        self.queue.size = 1
+        self.queue.pending = [FakeJob('queued')]
+        self.assertEqual(self.queue._next(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()